@@ -9,6 +9,10 @@ setup(
         'geopy',
         'diskcache'
     ],
+    extras_require={
+        # Computes the radii of utils/cache.py backfill-radii in one batch
+        'numpy': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'generate_data = generate_data.main:main',
@@ -1,25 +1,38 @@
 #!/usr/bin/python3
 
-import json
 import argparse
-from libs.data_scraper_lib import get_member_data
-from libs.location_nominatim_lib import examine_locations
-from libs.cache_thinning_lib import delete_random_cache_data
-
-def main():
+import os
+import time
+from libs.context_lib import Context
+from libs.data_scraper_lib import iter_member_data
+from libs.location_nominatim_lib import iter_examined_locations
+from libs.cache_refresh_lib import refresh_stalest_entries
+from libs.output_writer_lib import read_json_output, write_json_output
+from libs.cluster_tiles_lib import write_cluster_tiles
+from libs.member_index_lib import build_member_index
+from libs.columnar_output_lib import write_columnar_output
+from libs.run_journal_lib import RunJournal
+from libs.metrics_lib import write_run_report
+
+def main(ctx: Context = None):
     """
     Main function to run the data grabber.
 
-    This function parses command line arguments, retrieves member data,
-    examines locations, and writes the results to a JSON file.
+    This function parses command line arguments, retrieves member data and
+    examines their locations in a pipeline, and writes the results to a JSON file.
 
     Args:
-        None
+        ctx (Context): The runtime context, e.g. of a benchmark; a new one from config.json if None.
+            It is closed at the end.
 
     Returns:
         None
     """
 
+    # Runtime context with the configuration, the cache and the HTTP clients
+    ctx = ctx or Context()
+    config = ctx.config
+
     # Create an argument parser
     parser = argparse.ArgumentParser()
 
@@ -30,48 +43,194 @@ def main():
         help='Use the cache maximally'
     )
 
+    # Add an optional argument for the number of parallel profile downloads
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=config['workers'],
+        help='Number of concurrent profile downloads'
+    )
+
+    # Add an optional argument for the number of parser processes
+    parser.add_argument(
+        '--parse-processes',
+        type=int,
+        default=config['parse_processes'],
+        help='Number of processes parsing the downloaded pages (0 = parse in the download threads)'
+    )
+
+    # Add an optional argument for downloading the whole member list
+    parser.add_argument(
+        '--full-member-list',
+        action='store_true',
+        help='Download all member list pages instead of only the changed ones'
+    )
+
+    # Add optional arguments for the refresh budget of a run
+    parser.add_argument(
+        '--refresh-profiles',
+        type=int,
+        default=config['refresh_profiles'],
+        help='Number of the stalest cached profiles to download again'
+    )
+    parser.add_argument(
+        '--refresh-geocodes',
+        type=int,
+        default=config['refresh_geocodes'],
+        help='Number of the stalest cached Nominatim results to query again'
+    )
+
+    # Add an optional argument for writing all scraped data
+    parser.add_argument(
+        '--debug-dump',
+        action='store_true',
+        default=config['debug_dump'],
+        help='Also write all scraped member data to shared/members.json'
+    )
+
+    # Add an optional argument for limiting the duration of the run
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='Stop after this many minutes, write the output so far and continue in the next run'
+    )
+
+    # Add an optional argument for profiling the stages of the run
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write cProfile and tracemalloc snapshots of every stage to cache/profile'
+    )
+
     # Parse the command line arguments
     args = parser.parse_args()
 
-    # Shuffle the cache to achieve a better distribution of access times
-    # This can be removed after a few months
-    if not args.fast:
-        delete_random_cache_data("user_details", 1)
-        delete_random_cache_data("nominatim", 1)
-
-    # Retrieve member data
-    members = get_member_data()
-    print(f"Total members parsed: {len(members)}")  # Print the total number of members parsed
-
-    # Write the data to a JSON file / just for debug purposes
-    with open('shared/members.json', 'w', encoding='utf-8') as file:
-        json.dump(members, file, ensure_ascii=False, indent=4)
-    file.close()
-
-    # Examine locations
-    members = examine_locations(members)
-
-    # Prepare data for the JSON file
-    vmforum_members = []
-    for member in members:
-
-        data = {
-            'id': member['uid'],
-            'name': member['name'],
-            'lat': member['lat'],
-            'lon': member['lon'],
-            'radius': member['radius']
-        }
-        for key in ['vm', 'tr', 'lr', 'other']:
-            if member.get(key):
-                data[key] = member[key]
-
-        vmforum_members.append(data)
-
-    # Write the data to a JSON file
-    with open('shared/vmforum_members.json', 'w', encoding='utf-8') as vmforumfile:
-        json.dump(vmforum_members, vmforumfile, ensure_ascii=False, indent=2)
-    vmforumfile.close()
+    # The forum client sizes its connection pool from the configuration when it is created,
+    # so it has to know the number of workers of the command line before
+    config['workers'] = args.workers
+    metrics = ctx.metrics
+    if args.profile:
+        metrics.enable_profiling(os.path.join(ctx.cache_dir, 'profile'))
+    deadline = time.monotonic() + args.time_budget * 60 if args.time_budget else None
+
+    # Resume the last run if it was interrupted or stopped by its time budget
+    journal = RunJournal(ctx.cache_dir)
+    scraped = journal.members('scraped')
+    examined = journal.members('examined')
+    if journal.resumed:
+        print(f"Resuming the last run: {len(scraped)} members scraped, {len(examined)} with a position.")
+
+    # Refresh the stalest cache entries within the budget of this run
+    if not args.fast and not journal.resumed:
+        with metrics.stage('cache_refresh'):
+            refresh_stalest_entries(ctx, "user_details", args.refresh_profiles)
+            refresh_stalest_entries(ctx, "nominatim", args.refresh_geocodes)
+
+    # Retrieve member data and examine the locations in one stream:
+    # every member is geocoded as soon as its profile has been fetched
+    members_dict = dict(scraped)
+    stopped = False
+
+    # Position of every member in the member list of this run
+    list_positions = {}
+
+    def scraped_members():
+        nonlocal stopped
+        for member in iter_member_data(
+            ctx,
+            workers=args.workers,
+            incremental=config['incremental_member_list'] and not args.full_member_list,
+            parse_processes=args.parse_processes,
+            known_members=scraped
+        ):
+            if deadline is not None and time.monotonic() > deadline:
+                stopped = True
+                print("Time budget used up, stopping.")
+                return
+            list_positions.setdefault(member['uid'], len(list_positions))
+            if member['uid'] not in scraped:
+                journal.record(member['uid'], 'scraped', member)
+            members_dict[member['uid']] = member
+
+            # Members with a position from the interrupted run are done
+            if member['uid'] not in examined:
+                yield member
+
+    with metrics.stage('scrape_and_geocode'):
+        for member in iter_examined_locations(ctx, scraped_members()):
+            journal.record(member['uid'], 'examined', member)
+            examined[member['uid']] = member
+
+    # The members of a resumed run come first in the journal: restore the order of the
+    # member list, so the output does not depend on where the run was interrupted
+    def list_position(uid):
+        return list_positions.get(uid, len(list_positions))
+
+    members_dict = dict(sorted(members_dict.items(), key=lambda item: list_position(item[0])))
+    members = sorted(examined.values(), key=lambda member: list_position(member['uid']))
+
+    print(f"Total members parsed: {len(members_dict)}")  # Print the total number of members parsed
+    print(f"Members with a position: {len(members)}")
+
+    with metrics.stage('output_write'):
+        # Write the data to a JSON file / just for debug purposes
+        if args.debug_dump:
+            write_json_output('shared/members.json', members_dict, pretty=True, compress=False)
+
+        # Prepare data for the JSON file
+        vmforum_members = []
+        for member in members:
+
+            data = {
+                'id': member['uid'],
+                'name': member['name'],
+                'lat': member['lat'],
+                'lon': member['lon'],
+                'radius': member['radius']
+            }
+            for key in ['vm', 'tr', 'lr', 'other']:
+                if member.get(key):
+                    data[key] = member[key]
+
+            vmforum_members.append(data)
+
+        # A partial run keeps the members it did not reach from the last output
+        if stopped:
+            previous_members = read_json_output('shared/vmforum_members.json', [])
+            vmforum_members += [data for data in previous_members if data['id'] not in members_dict]
+
+        # Write the data to a minified JSON file with compressed copies, replacing the old one at once
+        size = write_json_output('shared/vmforum_members.json', vmforum_members)
+        print(f"Wrote {len(vmforum_members)} members ({size} bytes) to shared/vmforum_members.json")
+
+        # Write the search index of the map data
+        if config['member_index']:
+            size_index = write_json_output('shared/vmforum_members.index.json', build_member_index(vmforum_members))
+            print(f"Wrote the search index ({size_index} bytes) to shared/vmforum_members.index.json")
+
+        # Write the columnar binary copy of the map data with its manifest
+        if config['columnar_output']:
+            size_columns = write_columnar_output('shared/vmforum_members.bin', 'shared/vmforum_members.columns.json',
+                                                 vmforum_members)
+            print(f"Wrote the columnar map data ({size_columns} bytes) to shared/vmforum_members.bin")
+
+        # Write the precomputed marker clusters per zoom level and tile for the map
+        if config['cluster_tiles']:
+            tiles = write_cluster_tiles('shared/clusters', vmforum_members, config['cluster_tile_zoom'])
+            print(f"Wrote {tiles} cluster tiles to shared/clusters")
+
+    # Write the metrics of the run next to the output
+    metrics.set_gauge('members_parsed', len(members_dict))
+    metrics.set_gauge('members_positioned', len(members))
+    metrics.set_gauge('members_written', len(vmforum_members))
+    metrics.set_gauge('output_bytes', size)
+    metrics.set_gauge('complete', int(not stopped))
+    write_run_report(metrics.report(ctx.cache.lookup_stats()), config['run_report'], config['metrics_textfile'])
+
+    # A complete run starts over next time, a partial one is continued
+    journal.finish(complete=not stopped)
+    journal.close()
+    ctx.close()
 
 if __name__ == "__main__":
     main()
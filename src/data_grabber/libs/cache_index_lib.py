@@ -0,0 +1,360 @@
+import json
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+# Expiry times are spread by up to this fraction, so entries written in the same run
+# do not all expire in the same night
+EXPIRE_JITTER = 0.1
+
+
+def jittered(expire: float, fraction: float = EXPIRE_JITTER) -> float:
+    """
+    Spreads an expiry time randomly by up to +/- `fraction`.
+
+    Args:
+        expire (float): The expiry time in seconds.
+        fraction (float): The maximum relative deviation.
+
+    Returns:
+        float: The jittered expiry time in seconds.
+    """
+    return expire * random.uniform(1 - fraction, 1 + fraction)
+
+
+def encode_key(key) -> str:
+    """
+    Serializes a cache key (a tuple of strings, numbers and None) for the index table.
+    """
+    return json.dumps(list(key) if isinstance(key, tuple) else key, ensure_ascii=False)
+
+
+def value_size(value) -> int:
+    """
+    Returns the size of a value as stored by diskcache, in bytes.
+    """
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode_key(text: str):
+    """
+    Restores a cache key serialized by encode_key.
+    """
+    key = json.loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class CacheIndex:
+    """
+    SQLite table next to the diskcache that lists the entries of each named cache
+    ("namespace", the first element of the key tuple) with their times of writing and
+    expiry, their sizes and whether they hold a negative result (None), so that entries
+    can be counted, searched and selected by namespace and age without reading the whole
+    cache. The second element of a key is kept as its searchable label.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'namespace_index.db'), check_same_thread=False, isolation_level=None
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' key TEXT PRIMARY KEY, namespace TEXT, label TEXT, stored REAL, expires REAL, size INTEGER, negative INTEGER)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (namespace, expires)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_label ON entries (namespace, label)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_stored ON entries (namespace, stored)')
+        # Case-insensitive substring search, also for non-ASCII labels
+        self._connection.create_function('casefold', 1, lambda text: text.casefold() if text else text, deterministic=True)
+
+    def record(self, key, expires: float, stored: float = None, size: int = None, negative: bool = False) -> None:
+        """
+        Adds or updates the index entry of a cache key.
+
+        Args:
+            key: The cache key.
+            expires (float): The time of expiry as Unix timestamp, None for no expiry.
+            stored (float): The time the value was written, now if None.
+            size (int): The size of the stored value in bytes, if known.
+            negative (bool): The value is a negative result (None).
+        """
+        namespace = key[0] if isinstance(key, tuple) and key else None
+        label = str(key[1]) if isinstance(key, tuple) and len(key) > 1 else None
+        with self._lock:
+            self._connection.execute(
+                'REPLACE INTO entries (key, namespace, label, stored, expires, size, negative) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (encode_key(key), namespace, label, time.time() if stored is None else stored, expires, size, int(negative))
+            )
+
+    def stored(self, key) -> float:
+        """
+        Returns the time a key was written as Unix timestamp, None if it is not indexed.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT stored FROM entries WHERE key = ?', (encode_key(key),)).fetchone()
+        return row[0] if row else None
+
+    def remove(self, key) -> None:
+        """
+        Removes the index entry of a cache key.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE key = ?', (encode_key(key),))
+
+    def stalest(self, namespace: str, limit: int) -> list:
+        """
+        Returns the keys of the oldest valid entries of a namespace, i.e. the stalest ones.
+
+        Negative results are left out: they have a short lifetime of their own and
+        refreshing them would mostly repeat searches for unknown places.
+
+        Args:
+            namespace (str): The name of the named cache.
+            limit (int): The maximum number of keys.
+
+        Returns:
+            list: The keys, oldest first.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key FROM entries WHERE namespace = ? AND NOT negative AND (expires IS NULL OR expires > ?)'
+                ' ORDER BY stored, expires IS NULL, expires LIMIT ?',
+                (namespace, time.time(), limit)
+            ).fetchall()
+        return [decode_key(row[0]) for row in rows]
+
+    def namespaces(self) -> list:
+        """
+        Returns the number of valid entries and their total size for every namespace.
+
+        Returns:
+            list: (namespace, count, size) tuples, sorted by namespace.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+                ' WHERE expires IS NULL OR expires > ? GROUP BY namespace ORDER BY namespace',
+                (time.time(),)
+            ).fetchall()
+
+    def find(self, namespace: str = None, prefix: str = None, substring: str = None,
+             max_label_length: int = None, limit: int = None) -> list:
+        """
+        Searches the valid entries by namespace and label.
+
+        Args:
+            namespace (str): Only entries of this namespace, all if None.
+            prefix (str): Only labels starting with this text (case-sensitive, uses the index).
+            substring (str): Only labels containing this text, ignoring case.
+            max_label_length (int): Only labels of at most this length.
+            limit (int): The maximum number of entries, all if None.
+
+        Returns:
+            list: (key, size, expires) tuples, sorted by namespace and label.
+        """
+        conditions, parameters = ['(expires IS NULL OR expires > ?)'], [time.time()]
+        if namespace is not None:
+            conditions.append('namespace = ?')
+            parameters.append(namespace)
+        if prefix:
+            # A range on the label, so SQLite can use the (namespace, label) index
+            conditions.append('label >= ? AND label < ?')
+            parameters += [prefix, prefix + '\U0010ffff']
+        if substring:
+            conditions.append('instr(casefold(label), ?) > 0')
+            parameters.append(substring.casefold())
+        if max_label_length is not None:
+            conditions.append('length(label) <= ?')
+            parameters.append(max_label_length)
+        query = f'SELECT key, size, expires FROM entries WHERE {" AND ".join(conditions)} ORDER BY namespace, label'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return [(decode_key(key), size, expires) for key, size, expires in rows]
+
+    def purge_expired(self) -> int:
+        """
+        Removes the index entries of expired cache entries.
+
+        Returns:
+            int: The number of removed index entries.
+        """
+        with self._lock:
+            return self._connection.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),)).rowcount
+
+    def clear(self) -> None:
+        """
+        Removes all index entries.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+
+    def close(self) -> None:
+        """
+        Closes the index database.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def is_empty(self) -> bool:
+        """
+        Checks whether the index has no entries at all.
+        """
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM entries LIMIT 1').fetchone() is None
+
+    def rebuild(self, cache) -> int:
+        """
+        Fills the index from the entries of a diskcache, e.g. for a cache written
+        before the index existed. This reads every entry once.
+
+        Args:
+            cache (diskcache.Cache): The cache to index.
+
+        Returns:
+            int: The number of indexed entries.
+        """
+        missing = object()
+        count = 0
+        for key in cache.iterkeys():
+            value, expires = cache.get(key, default=missing, expire_time=True)
+            if value is not missing:
+                # The time of writing is unknown: the entry counts as older than every
+                # entry written since, and the expiry time keeps the order among them
+                self.record(key, expires, stored=0.0, size=value_size(value), negative=value is None)
+                count += 1
+        return count
+
+
+class IndexedCache:
+    """
+    Wraps a diskcache so that every write gets a jittered expiry time and is recorded
+    in the CacheIndex, and every deletion is removed from it again.
+    """
+
+    def __init__(self, cache, jitter: float = EXPIRE_JITTER):
+        self.cache = cache
+        self.jitter = jitter
+        self.index = CacheIndex(cache.directory)
+
+        # Number of hits and misses of the lookups, by (namespace, 'hits' or 'misses')
+        self.lookups = Counter()
+        self._lookups_lock = threading.Lock()
+
+        # Index a cache that was written before the index existed
+        if self.index.is_empty() and len(cache):
+            print(f"Indexed {self.reindex()} existing cache entries.")
+
+    def _count_lookup(self, key, hit: bool) -> None:
+        namespace = key[0] if isinstance(key, tuple) and key else None
+        with self._lookups_lock:
+            self.lookups[namespace, 'hits' if hit else 'misses'] += 1
+
+    def lookup_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of hits and misses of the lookups since the cache was opened.
+
+        Returns:
+            Dict[str, Dict[str, int]]: 'hits' and 'misses' by namespace.
+        """
+        with self._lookups_lock:
+            lookups = dict(self.lookups)
+        stats = {}
+        for (namespace, kind), count in lookups.items():
+            stats.setdefault(namespace, {'hits': 0, 'misses': 0})[kind] = count
+        return stats
+
+    def __contains__(self, key) -> bool:
+        found = key in self.cache
+        self._count_lookup(key, found)
+        return found
+
+    def __getitem__(self, key):
+        return self.cache[key]
+
+    def __delitem__(self, key) -> None:
+        self.delete(key)
+
+    def get(self, key, default=None, expire_time: bool = False):
+        """
+        Returns the value of a key, or `default` if it is missing or expired; with
+        `expire_time`, a tuple of the value and its time of expiry.
+        """
+        result = self.cache.get(key, default, expire_time=expire_time)
+        self._count_lookup(key, (result[0] if expire_time else result) is not default)
+        return result
+
+    def set(self, key, value, expire: float = None) -> None:
+        """
+        Stores a value with a jittered expiry time and records it in the index.
+
+        Args:
+            key: The cache key.
+            value: The value.
+            expire (float): The nominal lifetime in seconds, None for no expiry.
+        """
+        if expire is not None:
+            expire = jittered(expire, self.jitter)
+        self.cache.set(key, value, expire=expire)
+        self.index.record(key, time.time() + expire if expire is not None else None, size=value_size(value),
+                          negative=value is None)
+
+    def replace(self, key, value, expires: float = None) -> None:
+        """
+        Stores a new value under a key, keeping its times of writing and expiry.
+
+        Args:
+            key: The cache key.
+            value: The value.
+            expires (float): The time of expiry as Unix timestamp, as found in the index; None for no expiry.
+        """
+        self.cache.set(key, value, expire=expires - time.time() if expires is not None else None)
+        self.index.record(key, expires, stored=self.index.stored(key), size=value_size(value), negative=value is None)
+
+    def delete(self, key) -> bool:
+        """
+        Deletes a key from the cache and the index.
+
+        Returns:
+            bool: True if the key was in the cache.
+        """
+        self.index.remove(key)
+        return self.cache.delete(key)
+
+    def evict(self, keys) -> int:
+        """
+        Deletes a list of keys, e.g. the result of a search in the index.
+
+        Returns:
+            int: The number of keys that were in the cache.
+        """
+        return sum(1 for key in keys if self.delete(key))
+
+    def reindex(self) -> int:
+        """
+        Rebuilds the index from the cache.
+
+        Returns:
+            int: The number of indexed entries.
+        """
+        self.index.clear()
+        return self.index.rebuild(self.cache)
+
+    def close(self) -> None:
+        """
+        Closes the cache and its index.
+        """
+        self.index.close()
+        self.cache.close()
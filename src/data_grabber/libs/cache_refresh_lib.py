@@ -0,0 +1,27 @@
+from libs.context_lib import Context
+
+
+def refresh_stalest_entries(ctx: Context, cache_name: str, budget: int) -> int:
+    """
+    Deletes the oldest entries of a named cache, so that they are fetched again when
+    they are next needed, usually later in the same run.
+
+    The entries are taken from the cache index in the order of their time of writing,
+    so the refresh load of a run is bounded by `budget` and always hits the oldest data
+    first. Negative results are not refreshed; they expire on their own.
+
+    Args:
+        ctx (Context): The runtime context.
+        cache_name (str): The name of the cache to refresh, e.g. 'user_details'.
+        budget (int): The maximum number of entries to refresh.
+
+    Returns:
+        int: The number of deleted entries.
+    """
+    if budget <= 0:
+        return 0
+
+    deleted_count = ctx.cache.evict(ctx.cache.index.stalest(cache_name, budget))
+
+    print(f"{deleted_count} stalest items of named cache '{cache_name}' scheduled for refresh.")
+    return deleted_count
@@ -0,0 +1,318 @@
+"""
+Precomputed marker clusters for the map, per zoom level and tile.
+
+The members are clustered hierarchically like the map's markerClusterGroup does it
+(the same cluster radius per zoom level), but once per run instead of in every
+browser: starting with the single members above the highest zoom level, every level
+merges the points of the level below that lie within the cluster radius of each
+other, using a grid with the radius as cell size. The highest zoom level holds the
+single members, like the map does.
+
+The result is written to shared/clusters/<generation>/<z>/<x>/<y>.json, one file per
+zoom level and tile up to `tile_zoom`, so that the map only fetches the tiles in view
+and never needs the whole member list. Above `tile_zoom`, where most members stand on
+their own, the map uses the detail tiles shared/clusters/<generation>/detail/<x>/<y>.json
+(tiles of `tile_zoom`), which hold every member once with the zoom level from which it
+is shown on its own, and the few clusters of the higher zoom levels; see build_tiles.
+
+The generation is named after the hash of its tiles. manifest.json names the current
+generation and lists the existing tiles; it is written last, so a client always sees
+a complete generation.
+"""
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+from libs.output_writer_lib import dump_json, read_json_output, write_atomic, write_compressed, write_json_output
+
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+
+# Tiles are 256 pixels wide
+TILE_SIZE = 256
+
+# Highest zoom level whose tiles are written as files of their own
+TILE_ZOOM = 8
+
+# Tile files smaller than this are not pre-compressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def cluster_radius(zoom: int) -> int:
+    """
+    Returns the cluster radius of a zoom level in pixels, as used by karte.html.
+    """
+    return max(1, 40 - 3 * (zoom - 6))
+
+
+def project(lat: float, lon: float) -> tuple:
+    """
+    Projects a position to Web Mercator coordinates in the unit square (0, 0 is the north-west corner).
+    """
+    sin_lat = math.sin(math.radians(max(-85.05112878, min(85.05112878, lat))))
+    x = lon / 360 + 0.5
+    y = 0.5 - 0.25 * math.log((1 + sin_lat) / (1 - sin_lat)) / math.pi
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+def unproject(x: float, y: float) -> tuple:
+    """
+    Returns the latitude and longitude of Web Mercator coordinates in the unit square.
+    """
+    lon = (x - 0.5) * 360
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, lon
+
+
+class Node:
+    """
+    A member or a cluster on one zoom level.
+
+    Args:
+        x (float), y (float): The position in Web Mercator unit coordinates, weighted by the members.
+        count (int): The number of members.
+        children (List[int]): The indexes of the merged nodes on the next higher zoom level.
+        member (int): The index of the member, for a single member.
+    """
+    __slots__ = ('x', 'y', 'count', 'children', 'member')
+
+    def __init__(self, x: float, y: float, count: int, children: List[int], member: int = None):
+        self.x, self.y, self.count, self.children, self.member = x, y, count, children, member
+
+
+def cluster_level(nodes: List[Node], radius: float) -> List[Node]:
+    """
+    Merges the nodes that lie within `radius` of each other into clusters.
+
+    Args:
+        nodes (List[Node]): The nodes of the next higher zoom level.
+        radius (float): The cluster radius in Web Mercator unit coordinates.
+
+    Returns:
+        List[Node]: The nodes of this zoom level.
+    """
+    # Grid with the radius as cell size, so all neighbors are in the surrounding cells
+    grid = defaultdict(list)
+    for i, node in enumerate(nodes):
+        grid[int(node.x / radius), int(node.y / radius)].append(i)
+
+    radius_squared = radius * radius
+    merged = [False] * len(nodes)
+    level = []
+    for i, node in enumerate(nodes):
+        if merged[i]:
+            continue
+        merged[i] = True
+
+        cell_x, cell_y = int(node.x / radius), int(node.y / radius)
+        neighbors = [
+            j
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            for j in grid.get((cell_x + dx, cell_y + dy), ())
+            if not merged[j] and (nodes[j].x - node.x) ** 2 + (nodes[j].y - node.y) ** 2 <= radius_squared
+        ]
+        if not neighbors:
+            level.append(Node(node.x, node.y, node.count, [i], node.member))
+            continue
+
+        # The cluster is placed at the centroid of its members
+        children = [i] + neighbors
+        for j in neighbors:
+            merged[j] = True
+        count = sum(nodes[j].count for j in children)
+        x = sum(nodes[j].x * nodes[j].count for j in children) / count
+        y = sum(nodes[j].y * nodes[j].count for j in children) / count
+        level.append(Node(x, y, count, children))
+    return level
+
+
+def build_clusters(members: List[dict], min_zoom: int = MIN_ZOOM, max_zoom: int = MAX_ZOOM) -> Dict[int, List[Node]]:
+    """
+    Clusters the members for every zoom level.
+
+    Args:
+        members (List[dict]): The members with 'lat' and 'lon'.
+        min_zoom (int): The lowest zoom level.
+        max_zoom (int): The highest zoom level.
+
+    Returns:
+        Dict[int, List[Node]]: The nodes by zoom level; the level max_zoom + 1 holds the single members.
+    """
+    leaves = []
+    for index, member in enumerate(members):
+        try:
+            x, y = project(float(member['lat']), float(member['lon']))
+        except (KeyError, TypeError, ValueError):
+            continue
+        leaves.append(Node(x, y, 1, [], index))
+
+    levels = {max_zoom + 1: leaves}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        radius = cluster_radius(zoom) / (TILE_SIZE * 2 ** zoom)
+        levels[zoom] = cluster_level(levels[zoom + 1], radius)
+    return levels
+
+
+def expansion_zoom(levels: Dict[int, List[Node]], zoom: int, node: Node, max_zoom: int = MAX_ZOOM) -> int:
+    """
+    Returns the zoom level at which a cluster splits up into several nodes.
+    """
+    while zoom < max_zoom and len(node.children) == 1:
+        zoom += 1
+        node = levels[zoom][node.children[0]]
+    return min(zoom + 1, max_zoom)
+
+
+def tile_of(node: Node, zoom: int) -> tuple:
+    """
+    Returns the x and y of the tile of a zoom level that contains a node.
+    """
+    scale = 2 ** zoom
+    return int(node.x * scale), int(node.y * scale)
+
+
+def cluster_entry(levels: Dict[int, List[Node]], zoom: int, node: Node, max_zoom: int) -> list:
+    """
+    Returns a cluster as written to the tiles: [lat, lon, count, expansion zoom].
+    """
+    lat, lon = unproject(node.x, node.y)
+    return [round(lat, 5), round(lon, 5), node.count, expansion_zoom(levels, zoom, node, max_zoom)]
+
+
+def leaf_members(levels: Dict[int, List[Node]], zoom: int, node: Node) -> List[int]:
+    """
+    Returns the indexes of the members of a node.
+    """
+    nodes = [node]
+    for level in range(zoom + 1, max(levels) + 1):
+        nodes = [levels[level][child] for parent in nodes for child in parent.children]
+    return [leaf.member for leaf in nodes]
+
+
+def build_tiles(members: List[dict], levels: Dict[int, List[Node]], tile_zoom: int = TILE_ZOOM) -> Dict[tuple, dict]:
+    """
+    Distributes the clusters and members of every zoom level to tiles.
+
+    Up to `tile_zoom`, every zoom level has tiles of its own with the clusters and the
+    single members of the level. Above it, a detail tile per tile of `tile_zoom` holds
+    every member only once, with the zoom level from which it is shown on its own, and
+    the clusters of each higher zoom level. Members that share a position even on the
+    highest zoom level are listed with their cluster there, so the map can list them.
+
+    Args:
+        members (List[dict]): The members, as clustered by build_clusters.
+        levels (Dict[int, List[Node]]): The nodes by zoom level, see build_clusters.
+        tile_zoom (int): The highest zoom level with tiles of its own, below the highest zoom level.
+
+    Returns:
+        Dict[tuple, dict]: The tile contents by (z, x, y), with z = 'detail' for the detail
+            tiles. Tiles of a zoom level hold 'clusters' as [lat, lon, count, expansion zoom]
+            and 'members' as in vmforum_members.json; detail tiles hold 'members',
+            'single_zoom' (the zoom level of every member) and 'clusters' by zoom level,
+            where the clusters of the highest zoom level have their members as fifth element.
+    """
+    tiles = {}
+    max_zoom = max(levels) - 1
+
+    for zoom in range(min(levels), tile_zoom + 1):
+        for node in levels[zoom]:
+            tile = tiles.setdefault((zoom, *tile_of(node, zoom)), {'clusters': [], 'members': []})
+            if node.member is not None:
+                tile['members'].append(members[node.member])
+            else:
+                tile['clusters'].append(cluster_entry(levels, zoom, node, max_zoom))
+
+    def detail_tile(node):
+        return tiles.setdefault(('detail', *tile_of(node, tile_zoom)), {'members': [], 'single_zoom': [], 'clusters': {}})
+
+    # The lowest zoom level above tile_zoom from which every member stays on its own
+    single_zoom = {}
+    for zoom in range(max_zoom, tile_zoom, -1):
+        for node in levels[zoom]:
+            if node.member is not None and single_zoom.get(node.member, zoom + 1) == zoom + 1:
+                single_zoom[node.member] = zoom
+
+    for node in levels[max_zoom + 1]:
+        if node.member in single_zoom:
+            tile = detail_tile(node)
+            tile['members'].append(members[node.member])
+            tile['single_zoom'].append(single_zoom[node.member])
+
+    for zoom in range(tile_zoom + 1, max_zoom + 1):
+        for node in levels[zoom]:
+            if node.member is not None:
+                continue
+            entry = cluster_entry(levels, zoom, node, max_zoom)
+            if zoom == max_zoom:
+                entry.append([members[member] for member in leaf_members(levels, zoom, node)])
+            detail_tile(node)['clusters'].setdefault(str(zoom), []).append(entry)
+    return tiles
+
+
+def write_cluster_tiles(directory: str, members: List[dict], tile_zoom: int = TILE_ZOOM) -> int:
+    """
+    Clusters the members and writes the tiles of a new generation and the manifest.
+
+    The generation is named after the hash of its tiles, so an unchanged generation is
+    not written again. Older generations are removed, except the previous one, which
+    clients may still be loading.
+
+    Args:
+        directory (str): The output directory, e.g. 'shared/clusters'.
+        members (List[dict]): The members as written to vmforum_members.json.
+        tile_zoom (int): The highest zoom level with tiles of its own.
+
+    Returns:
+        int: The number of tiles of the generation.
+    """
+    tile_zoom = max(MIN_ZOOM, min(tile_zoom, MAX_ZOOM - 1))
+    levels = build_clusters(members)
+    tiles = build_tiles(members, levels, tile_zoom)
+
+    # The contents of the tiles, so the name of the generation changes with them
+    contents = {key: dump_json(tile) for key, tile in tiles.items()}
+    digest = hashlib.sha256(str(tile_zoom).encode())
+    for key in sorted(contents, key=str):
+        digest.update(str(key).encode() + contents[key])
+    generation = digest.hexdigest()[:16]
+
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    last = read_json_output(manifest_path, {})
+    previous = last.get('previous') if last.get('generation') == generation else last.get('generation')
+
+    if not os.path.isdir(os.path.join(directory, generation)):
+        # Written to a temporary directory first, so a generation directory is always complete
+        temp_directory = tempfile.mkdtemp(dir=directory, prefix='.' + generation)
+        for (z, x, y), content in contents.items():
+            path = os.path.join(temp_directory, str(z), str(x), f'{y}.json')
+            if len(content) >= MIN_COMPRESS_SIZE:
+                write_compressed(path, content)
+            write_atomic(path, content)
+        os.chmod(temp_directory, 0o755)
+        os.rename(temp_directory, os.path.join(directory, generation))
+
+    tile_index = defaultdict(list)
+    for z, x, y in sorted(tiles, key=str):
+        tile_index[z].append([x, y])
+    write_json_output(manifest_path, {
+        'generation': generation,
+        'previous': previous,
+        'min_zoom': MIN_ZOOM,
+        'max_zoom': MAX_ZOOM,
+        'tile_zoom': tile_zoom,
+        'members': len(members),
+        'tiles': {str(z): xy for z, xy in tile_index.items() if z != 'detail'},
+        'detail': tile_index['detail'],
+    })
+
+    # Remove the generations before the previous one, and unfinished ones
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and name not in (generation, previous):
+            shutil.rmtree(path)
+    return len(tiles)
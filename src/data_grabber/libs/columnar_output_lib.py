@@ -0,0 +1,150 @@
+"""
+Columnar binary copy of the map data, written next to vmforum_members.json.
+
+vmforum_members.json repeats every key for every member and stores the coordinates as
+decimal strings. The columnar copy stores every field as one column of 32 bit
+integers, which the map reads as typed arrays straight from the fetched buffer:
+
+- id: the user ID (int32)
+- lat, lon: the coordinates in units of 1e-7 degrees (int32), the precision of Nominatim
+- radius: the radius in meters (int32), -1 if unknown ('N/A')
+- name, vm, lr, tr, other: the position of the text in the string table (uint32),
+  0 if the member did not fill in the field
+
+The string table holds every distinct text once (the vehicle names repeat a lot), with
+the empty string first: a column of uint32 end offsets, followed by the UTF-8 encoded
+texts. All columns are little endian and in the member order of vmforum_members.json,
+so the positions of the search index apply to them as well.
+
+The manifest (vmforum_members.columns.json) describes the layout: the byte offset of
+every column, the string table and the size and checksum of the binary file.
+"""
+import sys
+import zlib
+from array import array
+from typing import Dict, List, Tuple
+
+from libs.output_writer_lib import write_atomic, write_compressed, write_json_output
+
+# Version of the layout, raised on incompatible changes
+COLUMNAR_VERSION = 1
+
+# The coordinates are stored as multiples of 1 / COORDINATE_SCALE degrees
+COORDINATE_SCALE = 10 ** 7
+
+# Radius of the members without a bounding box
+UNKNOWN_RADIUS = -1
+
+# The integer columns, with their typecode of the array module and their type in the manifest
+NUMBER_COLUMNS = [('id', 'i', 'int32'), ('lat', 'i', 'int32'), ('lon', 'i', 'int32'), ('radius', 'i', 'int32')]
+STRING_COLUMNS = ['name', 'vm', 'lr', 'tr', 'other']
+
+
+def quantize(coordinate) -> int:
+    """
+    Converts a coordinate in degrees (a number or a decimal string) to units of 1e-7 degrees.
+    """
+    return round(float(coordinate) * COORDINATE_SCALE)
+
+
+def little_endian(column: array) -> bytes:
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def build_columns(members: List[dict]) -> Tuple[bytes, Dict]:
+    """
+    Builds the binary file and the manifest of the columnar copy.
+
+    Args:
+        members (List[dict]): The members as written to vmforum_members.json.
+
+    Returns:
+        tuple: The content of the binary file and the manifest, see the module description.
+    """
+    columns = {name: array(typecode) for name, typecode, _ in NUMBER_COLUMNS}
+    columns.update({name: array('I') for name in STRING_COLUMNS})
+
+    # The string table: texts by position, and positions by text
+    strings = ['']
+    string_positions = {'': 0}
+
+    for member in members:
+        columns['id'].append(int(member['id']))
+        columns['lat'].append(quantize(member['lat']))
+        columns['lon'].append(quantize(member['lon']))
+        radius = member.get('radius')
+        columns['radius'].append(round(radius) if isinstance(radius, (int, float)) else UNKNOWN_RADIUS)
+
+        for name in STRING_COLUMNS:
+            text = member.get(name) or ''
+            position = string_positions.get(text)
+            if position is None:
+                position = string_positions[text] = len(strings)
+                strings.append(text)
+            columns[name].append(position)
+
+    # Every column is a multiple of 4 bytes long, so every typed array starts aligned
+    parts = []
+    offsets = {}
+    size = 0
+    for name, _, _ in NUMBER_COLUMNS:
+        parts.append(little_endian(columns[name]))
+        offsets[name] = size
+        size += len(parts[-1])
+    for name in STRING_COLUMNS:
+        parts.append(little_endian(columns[name]))
+        offsets[name] = size
+        size += len(parts[-1])
+
+    encoded = [text.encode('utf-8') for text in strings]
+    ends = array('I')
+    end = 0
+    for text in encoded:
+        end += len(text)
+        ends.append(end)
+    parts.append(little_endian(ends))
+    string_offsets = size
+    size += len(parts[-1])
+    parts += encoded
+
+    content = b''.join(parts)
+    manifest = {
+        'version': COLUMNAR_VERSION,
+        'members': len(members),
+        'bytes': len(content),
+        'checksum': format(zlib.crc32(content), '08x'),
+        'coordinate_scale': COORDINATE_SCALE,
+        'unknown_radius': UNKNOWN_RADIUS,
+        'columns': [
+            *({'name': name, 'type': kind, 'offset': offsets[name]} for name, _, kind in NUMBER_COLUMNS),
+            *({'name': name, 'type': 'string', 'offset': offsets[name]} for name in STRING_COLUMNS),
+        ],
+        'strings': {'count': len(strings), 'offsets': string_offsets, 'data': size, 'bytes': end},
+    }
+    return content, manifest
+
+
+def write_columnar_output(path: str, manifest_path: str, members: List[dict]) -> int:
+    """
+    Writes the columnar copy of the map data with its pre-compressed siblings.
+
+    The binary file is replaced before the manifest, so a manifest never describes a
+    file that is not there yet; the map compares the size and requests the file with
+    the checksum of the manifest to get past caches.
+
+    Args:
+        path (str): The path of the binary file.
+        manifest_path (str): The path of the JSON manifest.
+        members (List[dict]): The members as written to vmforum_members.json.
+
+    Returns:
+        int: The size of the binary file in bytes.
+    """
+    content, manifest = build_columns(members)
+    write_compressed(path, content)
+    write_atomic(path, content)
+    write_json_output(manifest_path, manifest, compress=False)
+    return len(content)
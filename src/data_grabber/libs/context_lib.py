@@ -0,0 +1,202 @@
+"""
+Runtime context of the data grabber: configuration, cache and HTTP clients.
+
+Everything is created on first use, so the libs can be imported (e.g. by the
+utilities) without reading the configuration, opening the cache or touching the
+network. All libs take the context as their first parameter and share its resources.
+"""
+import json
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import diskcache as dc
+import requests
+from requests.adapters import HTTPAdapter
+
+from libs.cache_index_lib import IndexedCache
+from libs.metrics_lib import Metrics
+from libs.rate_limiter_lib import TokenBucket
+
+# Settings used when they are missing in config.json
+DEFAULT_CONFIG = {
+    'forum_url': 'https://www.velomobilforum.de',
+    'nominatim_url': 'https://nominatim.openstreetmap.org',
+    'workers': 4,
+    'requests_per_second': 4,
+    'parse_processes': 0,
+    'incremental_member_list': True,
+    'html_parser': None,
+    'refresh_profiles': 50,
+    'nominatim_requests_per_second': 1,
+    'geocode_workers': 4,
+    'analysis_cache_size': 4096,
+    'persistent_analysis_cache': True,
+    'refresh_geocodes': 20,
+    'nominatim_negative_expire_days': 7,
+    'postal_gazetteer': 'cache/postal_codes.db',
+    'debug_dump': False,
+    'member_index': True,
+    'columnar_output': True,
+    'cluster_tiles': True,
+    'cluster_tile_zoom': 8,
+    'run_report': 'shared/run_report.json',
+    'metrics_textfile': 'shared/vmkarte.prom',
+}
+
+# Number of pooled connections per host, the default of requests
+POOL_SIZE = 10
+
+# Headers to mimic a browser
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+class HostClient:
+    """
+    Connection-pooled HTTP session for one host, with the rate limit of that host.
+    """
+
+    def __init__(self, rate: float = None, pool_size: int = POOL_SIZE, metrics: Metrics = None, host: str = None):
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+        self.limiter = TokenBucket(rate) if rate else None
+        self.metrics = metrics
+        self.host = host
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request, recording its status and latency in the metrics.
+        """
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.metrics.observe_request(self.host, 'error', time.perf_counter() - start)
+            raise
+        self.metrics.observe_request(self.host, response.status_code, time.perf_counter() - start)
+        return response
+
+    def get(self, url: str, extra_headers: Dict[str, str] = None) -> requests.Response:
+        """
+        Sends a GET request as soon as the rate limit allows it.
+
+        Args:
+            url (str): The URL to request.
+            extra_headers (Dict[str, str]): Additional request headers, e.g. for conditional requests.
+
+        Returns:
+            requests.Response: The response of the request.
+        """
+        if self.limiter:
+            waited = self.limiter.acquire()
+            if self.metrics is not None:
+                self.metrics.count('rate_limit_wait_seconds', waited, host=self.host)
+        return self._request('GET', url, headers=extra_headers)
+
+    def post(self, url: str, data: dict) -> requests.Response:
+        """
+        Sends a POST request; posts are not rate limited.
+        """
+        return self._request('POST', url, data=data)
+
+
+class Context:
+    """
+    Lazily created resources of one run, shared by all libs and threads.
+
+    Args:
+        config_path (str): The path of config.json.
+        cache_dir (str): The directory of the disk cache.
+        config (dict): Settings to use instead of reading `config_path`.
+    """
+
+    def __init__(self, config_path: str = 'config.json', cache_dir: str = 'cache', config: dict = None):
+        self.config_path = config_path
+        self.cache_dir = cache_dir
+        self._config = config
+        self._resources = {}
+        self._lock = threading.RLock()
+
+        # Pool of parser processes while a scrape is running, see data_scraper_lib.start_parse_pool
+        self.parse_pool = None
+
+    def resource(self, name: str, factory):
+        """
+        Returns a resource of the context, creating it with `factory` on first use.
+
+        Args:
+            name (str): The name of the resource.
+            factory (callable): Creates the resource; called at most once per context.
+
+        Returns:
+            The resource.
+        """
+        resource = self._resources.get(name)
+        if resource is None:
+            with self._lock:
+                resource = self._resources.get(name)
+                if resource is None:
+                    resource = self._resources[name] = factory()
+        return resource
+
+    def _load_config(self) -> dict:
+        config = self._config
+        if config is None:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        return {**DEFAULT_CONFIG, **config}
+
+    @property
+    def config(self) -> dict:
+        """
+        The settings of config.json, completed with DEFAULT_CONFIG.
+        """
+        return self.resource('config', self._load_config)
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        The metrics of the run.
+        """
+        return self.resource('metrics', Metrics)
+
+    @property
+    def cache(self) -> IndexedCache:
+        """
+        The disk cache with its index.
+        """
+        return self.resource('cache', lambda: IndexedCache(dc.Cache(self.cache_dir)))
+
+    def client(self, url: str, rate: float = None, pool_size: int = POOL_SIZE) -> HostClient:
+        """
+        Returns the HTTP client of the host of `url`.
+
+        Args:
+            url (str): A URL on the host.
+            rate (float): The maximum number of requests per second; only used when the client is created.
+            pool_size (int): The number of pooled connections; only used when the client is created.
+
+        Returns:
+            HostClient: The client of the host.
+        """
+        host = urlparse(url).netloc
+        return self.resource(('client', host), lambda: HostClient(rate, pool_size, self.metrics, host))
+
+    def close(self) -> None:
+        """
+        Closes the cache and the HTTP sessions that were opened.
+        """
+        with self._lock:
+            for resource in self._resources.values():
+                if isinstance(resource, HostClient):
+                    resource.session.close()
+                elif isinstance(resource, IndexedCache):
+                    resource.close()
+            self._resources.clear()
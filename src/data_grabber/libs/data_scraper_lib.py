@@ -1,30 +1,115 @@
-import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import requests
 from bs4 import BeautifulSoup
-import diskcache as dc
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple
+from libs.context_lib import POOL_SIZE, Context, HostClient
+from libs.html_parser_lib import get_backend, parse_member_list, parse_profile_page
 
-cache = dc.Cache('cache')
+# Number of additional attempts for a member list page that could not be downloaded
+PAGE_RETRIES = 3
 
-# Read configuration file
-with open('config.json', 'r', encoding='utf-8') as f:
-    config = json.load(f)
+# Lifetime of a cached member list page
+MEMBER_PAGE_EXPIRE = 60*60*24*7-60*60
 
-# Login data to velomobilforum.de
-USERNAME = config['username']
-PASSWORD = config['password']
+# Lifetime of the validators and parsed details used to refresh expired user details
+USER_DETAILS_META_EXPIRE = 60*60*24*90
 
-# Start a session
-session = requests.Session()
+# Number of fetched profiles between two progress messages
+PROGRESS_INTERVAL = 100
 
-# Headers to mimic a browser
-headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-}
 
-def login():
+def forum_url(ctx: Context) -> str:
     """
-    Logs in to the website using the provided credentials.
+    Returns the base URL of the forum, e.g. of a replay server for benchmarks.
+    """
+    return ctx.config['forum_url'].rstrip('/')
+
+
+def forum_client(ctx: Context) -> HostClient:
+    """
+    Returns the HTTP client of the forum, with a connection pool large enough for all
+    workers and the politeness cap of the configuration.
+
+    The pool is sized when the client is created, from the 'workers' setting; a caller
+    that runs more workers (e.g. data_grabber.py --workers) sets it before.
+    """
+    pool_size = max(ctx.config['workers'], POOL_SIZE)
+    return ctx.client(forum_url(ctx), rate=ctx.config['requests_per_second'], pool_size=pool_size)
+
+
+def html_parser(ctx: Context) -> str:
+    """
+    Returns the parser backend for the member list and profile pages.
+    """
+    return ctx.resource('html_parser', lambda: get_backend(ctx.config['html_parser']))
+
+
+def throttled_get(ctx: Context, url: str, extra_headers: Dict[str, str] = None) -> requests.Response:
+    """
+    Sends a GET request over the shared session, respecting the per-host rate cap.
+
+    Args:
+        ctx (Context): The runtime context.
+        url (str): The URL to request.
+        extra_headers (Dict[str, str]): Additional request headers, e.g. for conditional requests.
+
+    Returns:
+        requests.Response: The response of the request.
+    """
+    return forum_client(ctx).get(url, extra_headers)
+
+
+def start_parse_pool(ctx: Context, processes: int) -> None:
+    """
+    Starts the processes that parse the downloaded pages, if `processes` is positive.
+
+    The download threads then hand the raw response bytes to the pool and get back
+    the small extracted dictionaries, so that parsing is not serialized by the GIL.
+    The processes are spawned, not forked, since the download threads may be running.
+
+    Args:
+        ctx (Context): The runtime context, which keeps the pool.
+        processes (int): The number of parser processes; 0 parses in the calling threads.
+    """
+    if processes > 0 and ctx.parse_pool is None:
+        ctx.parse_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def stop_parse_pool(ctx: Context) -> None:
+    """
+    Stops the parser processes started by start_parse_pool.
+    """
+    if ctx.parse_pool is not None:
+        ctx.parse_pool.shutdown()
+        ctx.parse_pool = None
+
+
+def parse(ctx: Context, function, *args):
+    """
+    Runs a parser function of html_parser_lib in the parser pool, or directly if there is none.
+    Both ways run the same function on the same input, so the results are identical.
+
+    Args:
+        ctx (Context): The runtime context.
+        function (callable): A module-level function of html_parser_lib.
+        *args: The arguments of the function.
+
+    Returns:
+        The result of the function.
+    """
+    if ctx.parse_pool is None:
+        return function(*args)
+    return ctx.parse_pool.submit(function, *args).result()
+
+
+def login(ctx: Context):
+    """
+    Logs in to the website using the credentials of the configuration.
+
+    Args:
+        ctx (Context): The runtime context; the login cookies are kept in its forum client.
 
     Raises:
         Exception: If login fails or an error occurs during the login process.
@@ -32,8 +117,9 @@ def login():
     try:
         # Get the login page to retrieve the _xfToken
 
-        login_url = 'https://www.velomobilforum.de/forum/index.php?login/login'
-        login_page = session.get(login_url, headers=headers)
+        login_url = f'{forum_url(ctx)}/forum/index.php?login/login'
+        client = forum_client(ctx)
+        login_page = client.get(login_url)
         login_page.raise_for_status()
 
         # Parse the login page HTML to extract the _xfToken
@@ -42,15 +128,15 @@ def login():
 
         # Perform login
         payload = {
-            'login': USERNAME,
-            'password': PASSWORD,
+            'login': ctx.config['username'],
+            'password': ctx.config['password'],
             'remember': '1',
-            '_xfRedirect': 'https://www.velomobilforum.de/forum/index.php',
+            '_xfRedirect': f'{forum_url(ctx)}/forum/index.php',
             '_xfToken': token
         }
 
-        login_post_url = 'https://www.velomobilforum.de/forum/index.php?login/login'
-        response = session.post(login_post_url, data=payload, headers=headers)
+        login_post_url = f'{forum_url(ctx)}/forum/index.php?login/login'
+        response = client.post(login_post_url, data=payload)
         response.raise_for_status()
 
         # Check if the login was successful
@@ -61,140 +147,266 @@ def login():
         raise
 
 
-def get_members_from_dictionary_soup(soup: BeautifulSoup) -> List[Dict[str, str]]:
+def fetch_members_list_page(ctx: Context, page_number: int, retries: int = PAGE_RETRIES) -> Tuple[List[Dict[str, str]], int]:
     """
-    Extracts members information from a BeautifulSoup object.
+    Downloads and parses one page of the member list, retrying failed downloads.
 
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+        ctx (Context): The runtime context.
+        page_number (int): The number of the member list page.
+        retries (int): The number of additional attempts after a failed download.
 
     Returns:
-        List[Dict[str, str]]: A list of dictionaries containing member information.
-            Each dictionary contains the following keys:
-            - 'uid': The user ID.
-            - 'name': The member name.
-            - 'location': The member location (if available).
-            - 'href': The member link.
+        Tuple[List[Dict[str, str]], int]: The members listed on the page and the total number of pages.
 
+    Raises:
+        Exception: If the page could not be retrieved after all attempts.
     """
-    members = []
-    for user in soup.select('h3.contentRow-header a.username'):
-        member = {
-            'uid': user['data-user-id'],
-
-            'name': user.get_text(),
-        }
-
-        # Find the parent div with class 'contentRow-main'
-        content_row_main = user.find_parent('div', class_='contentRow-main')
-
-        # Find the div with class 'contentRow-lesser' inside the parent div
-        location_div = content_row_main.find('div', class_='contentRow-lesser')
-
-        # If the location div exists and contains an anchor tag, extract the location
-        if location_div and location_div.find('a'):
-            member['location'] = location_div.find('a').get_text()
-
-        # Store the member link
-        member['href'] = user['href']
-
-        members.append(member)
-    return members
+    url = f'{forum_url(ctx)}/forum/index.php?members/list/&page={page_number}'
+    for attempt in range(retries + 1):
+        try:
+            page = throttled_get(ctx, url)
+            page.raise_for_status()
+            return parse(ctx, parse_member_list, page.content, html_parser(ctx), page.encoding)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            ctx.metrics.count('retries', stage='list_crawl')
+            print(f"An error occurred while downloading member list page {page_number}, retrying: {e}")
+            # Back off a little longer after every failed attempt
+            time.sleep(2 ** attempt)
 
 
-@cache.memoize(name='members_dict', expire=60*60*24-60*60)
-def get_members_dictionary():
+def get_members_dictionary(ctx: Context, workers: int = None, incremental: bool = None):
     """
     Retrieves a dictionary of members from the Velomobilforum website.
 
-    The dictionary is memoized with the name 'members_dict' and expires after 23 hours.
+    Every member list page is cached on its own with the name 'member_page' and
+    expires after about a week. Pages that have to be downloaded are fetched by a pool
+    of `workers` threads; a page that still fails after its retries is replaced by its
+    cached copy, if there is one, and reported.
+
+    In incremental mode, the list is paged through from the start only until a page
+    without new members is reached; the following pages are taken from the cache as
+    long as their entries are valid. The members of all cached pages are kept, so
+    members that merely moved to another page are not lost; deleted members vanish
+    when their page expires.
+
+    Args:
+        ctx (Context): The runtime context.
+        workers (int): The maximum number of concurrent page downloads, from the configuration if None.
+        incremental (bool): Stop paging at the first page without new members, from the configuration if None.
 
     Returns:
         dict: A dictionary where the keys are the member IDs and the values are dictionaries
               containing member information.
     """
+    workers = ctx.config['workers'] if workers is None else workers
+    incremental = ctx.config['incremental_member_list'] if incremental is None else incremental
+    cache = ctx.cache
+    fresh_pages = {}
 
-    members_dict = {}
-
-    # Get the number of dictionary pages by retrieving the first page
-    pages = 1  # default
-
+    # Retrieve the first page to determine the number of pages
+    print("Getting number of pages...")
     try:
-        # Retrieve the first page to determine the number of pages
-        print("Getting number of pages...")
-        page = session.get('https://www.velomobilforum.de/forum/index.php?members/list/', headers=headers)
-        page.raise_for_status()
-        soup = BeautifulSoup(page.text, 'html.parser')
-
-        # Extract the page numbers from the HTML
-        pages_numbers = [int(a.text) for a in soup.select('ul.pageNav-main li.pageNav-page a') if a.text.isdigit()]
-        pages = max(pages_numbers) if pages_numbers else 1
+        first_page_members, pages = fetch_members_list_page(ctx, 1)
     except Exception as e:
         print(f"An error occurred while retrieving pages: {e}")
+        first_page_members, pages = None, 0
+
+    # Read the cached pages before any of them gets overwritten
+    if pages:
+        cached_pages = {i: cache.get(('member_page', i)) for i in range(1, pages + 1)}
+    else:
+        # Without the page count, fall back to the consecutive cached pages
+        cached_pages = {}
+        while (members := cache.get(('member_page', len(cached_pages) + 1))) is not None:
+            cached_pages[len(cached_pages) + 1] = members
+        pages = len(cached_pages)
+
+    def store_page(i, members):
+        fresh_pages[i] = members
+        cache.set(('member_page', i), members, expire=MEMBER_PAGE_EXPIRE)
+
+    if first_page_members is not None:
+        store_page(1, first_page_members)
+
+    if incremental:
+        known_uids = {member['uid'] for members in cached_pages.values() if members for member in members}
+
+        # Page through the list until a page brings no new members
+        i = 1
+        while i in fresh_pages and i < pages and any(member['uid'] not in known_uids for member in fresh_pages[i]):
+            i += 1
+            try:
+                store_page(i, fetch_members_list_page(ctx, i)[0])
+                print(f"Processed member list page {i}/{pages}")
+            except Exception as e:
+                ctx.metrics.count('errors', stage='list_crawl')
+                print(f"An error occurred while downloading member list page {i}: {e}")
+                break
+
+        # The remaining pages only have to be downloaded if they are not cached
+        to_fetch = [i for i in range(1, pages + 1) if i not in fresh_pages and cached_pages.get(i) is None]
+    else:
+        to_fetch = [i for i in range(1, pages + 1) if i not in fresh_pages]
+
+    # Download the pages concurrently, parsing each one as it arrives
+    failed_pages = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(fetch_members_list_page, ctx, i): i for i in to_fetch}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                store_page(i, future.result()[0])
+                print(f"Processed member list page {i}/{pages} ({len(fresh_pages)} done)")
+            except Exception as e:
+                ctx.metrics.count('errors', stage='list_crawl')
+                print(f"An error occurred while downloading member list page {i}: {e}")
+                failed_pages.append(i)
+
+    if failed_pages:
+        print(f"Member list pages {sorted(failed_pages)} could not be retrieved, using cached copies where available.")
+
+    # Add the member information to the dictionary: the downloaded pages in page order,
+    # then the members of cached pages that were not seen again
+    fallback_pages = cached_pages if incremental else {i: cached_pages[i] for i in failed_pages}
+    members_dict = {}
+    for i in sorted(fresh_pages):
+        for member in fresh_pages[i]:
+            members_dict[member['uid']] = member
+    for i in sorted(fallback_pages):
+        for member in fallback_pages[i] or []:
+            members_dict.setdefault(member['uid'], member)
 
-    # Iterate over all other dictionary pages
-    for i in range(1, pages + 1):
-        print(f"Processing member list page {i}/{pages}...")
-        try:
-            # Retrieve the HTML content of the current page
-            page = session.get(f'https://www.velomobilforum.de/forum/index.php?members/list/&page={i}', headers=headers)
-            page.raise_for_status()
-            soup = BeautifulSoup(page.text, 'html.parser')
-
-            # Extract the member information from the HTML
-            members = get_members_from_dictionary_soup(soup)
-
-            # Add the member information to the dictionary
-            for member in members:
-                members_dict[member['uid']] = member
-        except Exception as e:
-            print(f"An error occurred while downloading page {page}: {e}")
+    print(f"{len(fresh_pages)} / {pages} member list pages downloaded, {len(members_dict)} members found.")
 
     return members_dict
 
 
-def get_member_data():
+def iter_member_data(ctx: Context, workers: int = None, incremental: bool = None,
+                     parse_processes: int = None, known_members: Dict[str, dict] = None) -> Iterator[Dict[str, str]]:
     """
-    Retrieves member data by logging in, getting the member dictionary,
-    fetching user details for each member, and returning the updated member dictionary.
+    Logs in, gets the member dictionary and yields every member with its user details
+    as soon as they are available.
 
-    Returns:
-        dict: A dictionary where the keys are the member IDs and the values are dictionaries
-              containing updated member information.
+    Cached user details are used directly; only the missing profiles are downloaded,
+    by a pool of `workers` threads. The members are yielded in the order of the member
+    list, independent of the order in which the downloads finish.
+
+    Args:
+        ctx (Context): The runtime context.
+        workers (int): The maximum number of concurrent profile downloads, from the configuration if None.
+        incremental (bool): Only download the member list pages that changed, from the configuration if None.
+        parse_processes (int): The number of processes parsing the pages; 0 parses in the download threads.
+            From the configuration if None.
+        known_members (Dict[str, dict]): Members whose details are known already, e.g. from the
+            run journal, by user ID; they are neither looked up in the cache nor downloaded.
+
+    Yields:
+        Dict[str, str]: The member information including the user details.
     """
+    workers = ctx.config['workers'] if workers is None else workers
+    parse_processes = ctx.config['parse_processes'] if parse_processes is None else parse_processes
+
     # Log in to the website
-    login()
+    with ctx.metrics.stage('login'):
+        login(ctx)
 
-    # Get the member dictionary
-    members_dict = get_members_dictionary()
+    start_parse_pool(ctx, parse_processes)
+    try:
+        yield from iter_fetched_members(ctx, workers, incremental, known_members)
+    finally:
+        stop_parse_pool(ctx)
 
-    # Get the number of members
-    num_members = len(members_dict)
 
-    # Iterate over each member in the member dictionary
-    for i, uid in enumerate(members_dict, start=1):
-        # Get the member details
-        member = members_dict[uid]
+def iter_fetched_members(ctx: Context, workers: int, incremental: bool,
+                         known_members: Dict[str, dict] = None) -> Iterator[Dict[str, str]]:
+    """
+    Gets the member dictionary and yields every member with its user details, see iter_member_data.
 
-        # Print the progress
-        print(f'Processing Member {i} / {num_members} ({member["name"]})')
+    When the consumer stops early, the downloads that have not started are cancelled.
 
-        # Sort the member details
-        member = {key: member[key] for key in sorted(member)}
+    Args:
+        ctx (Context): The runtime context.
+        workers (int): The maximum number of concurrent profile downloads.
+        incremental (bool): Only download the member list pages that changed.
+        known_members (Dict[str, dict]): Members whose details are known already, by user ID.
 
-        # Fetch user details for the member
-        members_dict[uid] = fetch_user_details(member)
+    Yields:
+        Dict[str, str]: The member information including the user details.
+    """
+    # Get the member dictionary
+    with ctx.metrics.stage('list_crawl'):
+        members_dict = get_members_dictionary(ctx, workers, incremental)
 
-    # Return the updated member dictionary
-    return members_dict
+    # Get the number of members
+    num_members = len(members_dict)
+
+    # Use the cached user details, collect the members that have to be fetched
+    members = []
+    pending = []
+    known_members = known_members or {}
+    for uid, member in members_dict.items():
+        cached_member = known_members.get(uid) or ctx.cache.get(('user_details', uid))
+        if cached_member is not None:
+            members.append(cached_member)
+        else:
+            # Sort the member details
+            members.append({key: member[key] for key in sorted(member)})
+            pending.append(len(members) - 1)
+
+    print(f'{num_members - len(pending)} / {num_members} members found in cache, fetching {len(pending)} profiles...')
+
+    # Fetch the missing user details concurrently, hand out all members in list order;
+    # timed once around the pool, as the downloads of the threads overlap
+    with ctx.metrics.stage('profile_fetch'):
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            futures = {i: executor.submit(fetch_user_details, ctx, members[i]) for i in pending}
+            fetched = 0
+            for i, member in enumerate(members):
+                if i in futures:
+                    member = futures.pop(i).result()
+                    # Print the progress now and then
+                    fetched += 1
+                    if fetched % PROGRESS_INTERVAL == 0 or fetched == len(pending):
+                        print(f'{fetched} / {len(pending)} profiles fetched')
+                yield member
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def get_member_data(ctx: Context, workers: int = None, incremental: bool = None, parse_processes: int = None):
+    """
+    Retrieves member data by logging in, getting the member dictionary,
+    fetching user details for each member, and returning the updated member dictionary.
+
+    Args:
+        ctx (Context): The runtime context.
+        workers (int): The maximum number of concurrent profile downloads.
+        incremental (bool): Only download the member list pages that changed.
+        parse_processes (int): The number of processes parsing the pages; 0 parses in the download threads.
 
+    Returns:
+        dict: A dictionary where the keys are the member IDs and the values are dictionaries
+              containing updated member information.
+    """
+    return {member['uid']: member for member in iter_member_data(ctx, workers, incremental, parse_processes)}
 
 
-def fetch_user_details(member):
+def fetch_user_details(ctx: Context, member):
     """
     Fetches user details from the Velomobilforum website and updates the member dictionary.
 
+    Besides the user details, a 'user_details_meta' entry with a longer lifetime keeps
+    the ETag, the Last-Modified date and a hash of the relevant part of the profile.
+    When the user details have expired, the profile is requested conditionally; if the
+    server answers 304 or the relevant part is unchanged, the stored details are reused
+    and only their lifetime is extended.
+
     Args:
+        ctx (Context): The runtime context.
         member (dict): A dictionary containing member information.
 
     Returns:
@@ -203,44 +415,58 @@ def fetch_user_details(member):
     Raises:
         Exception: If an error occurs during the fetch process.
     """
+    cache = ctx.cache
+
     # Construct the profile URL
-    profile_url = f"https://www.velomobilforum.de{member['href']}about"
+    profile_url = f"{forum_url(ctx)}{member['href']}about"
 
     # Check if the entry exists in the cache
     cache_key = ('user_details', member['uid'])
     if cache_key in cache:
         return cache[cache_key]
 
+    # Validators of the last download, if any
+    meta_key = ('user_details_meta', member['uid'])
+    meta = cache.get(meta_key)
+    conditional_headers = {}
+    if meta:
+        if meta.get('etag'):
+            conditional_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = meta['last_modified']
+
     try:
         # Fetch the profile page
-        response = session.get(profile_url, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Find all the dl elements with class 'pairs--columns'
-        dl_elements = soup.find_all('dl', class_='pairs--columns')
-
-        # Iterate over each dl element
-        for dl in dl_elements:
-            dt = dl.find('dt').text.strip()
-            dd = dl.find('dd').text.strip()
-
-            # Update the member dictionary based on the dt value
-            if dt == "Velomobil":
-                member['vm'] = dd
-            elif dt == "Liegerad":
-                member['lr'] = dd
-            elif dt == "Trike":
-                member['tr'] = dd
-            elif dt == "sonstige Fahrzeuge/Bemerkungen":
-                member['other'] = dd
+        response = throttled_get(ctx, profile_url, conditional_headers)
+
+        if meta and response.status_code == 304:
+            # Not modified: keep the stored details
+            details = meta['details']
+            fragment_hash = meta['fragment_hash']
+        else:
+            response.raise_for_status()
+
+            # Take the new details only if the relevant part of the profile changed
+            fragment_hash, details = parse(
+                ctx, parse_profile_page, response.content, html_parser(ctx), response.encoding,
+                meta['fragment_hash'] if meta else None
+            )
+            if details is None:
+                details = meta['details']
+
+        member.update(details)
 
         # Save the result in the cache
         cache.set(cache_key, member, expire=60*60*24*14-60*60)
+        cache.set(meta_key, {
+            'etag': response.headers.get('ETag', meta.get('etag') if meta else None),
+            'last_modified': response.headers.get('Last-Modified', meta.get('last_modified') if meta else None),
+            'fragment_hash': fragment_hash,
+            'details': details,
+        }, expire=USER_DETAILS_META_EXPIRE)
 
     except Exception as e:
+        ctx.metrics.count('errors', stage='profile_fetch')
         print(f"An error occurred while fetching user details from {profile_url}: {e}")
 
     return member
-
-
@@ -0,0 +1,356 @@
+"""
+Extraction of member data from the forum's HTML pages, with interchangeable parser backends.
+
+The backends are tried in the order of PARSER_BACKENDS: selectolax and lxml are used
+when they are installed, BeautifulSoup is always available. The BeautifulSoup backend
+only builds the subtrees that hold the wanted data (SoupStrainer).
+"""
+import hashlib
+from typing import Dict, List, Tuple, Union
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+# Parser backends, fastest first
+PARSER_BACKENDS = ['selectolax', 'lxml', 'bs4']
+
+# Labels of the profile fields and the keys they are stored under
+PROFILE_FIELDS = {
+    "Velomobil": 'vm',
+    "Liegerad": 'lr',
+    "Trike": 'tr',
+    "sonstige Fahrzeuge/Bemerkungen": 'other',
+}
+
+
+
+def available_backends() -> List[str]:
+    """
+    Returns the names of the parser backends that can be used.
+
+    Returns:
+        List[str]: The available backends, fastest first.
+    """
+    installed = {'selectolax': HTMLParser is not None, 'lxml': lxml_html is not None, 'bs4': True}
+    return [backend for backend in PARSER_BACKENDS if installed[backend]]
+
+
+def get_backend(name: str = None) -> str:
+    """
+    Chooses a parser backend.
+
+    Args:
+        name (str): The preferred backend; if None or not installed, the fastest available one is used.
+
+    Returns:
+        str: The name of the backend.
+    """
+    backends = available_backends()
+    if name in backends:
+        return name
+    if name is not None:
+        print(f"HTML parser backend '{name}' is not available, using '{backends[0]}'.")
+    return backends[0]
+
+
+def has_class(class_attribute: str, class_name: str) -> bool:
+    """
+    Checks whether a class attribute value contains a class name.
+    """
+    return class_name in (class_attribute or '').split()
+
+
+def xpath_class(class_name: str) -> str:
+    """
+    Returns an XPath condition that matches elements with the given class.
+    """
+    return f'contains(concat(" ", normalize-space(@class), " "), " {class_name} ")'
+
+
+def decode_html(html: Union[bytes, str], encoding: str = None) -> str:
+    """
+    Decodes a raw response body; strings are returned unchanged.
+
+    Args:
+        html (Union[bytes, str]): The response body.
+        encoding (str): The encoding announced by the server, UTF-8 if None.
+
+    Returns:
+        str: The decoded HTML.
+    """
+    if isinstance(html, bytes):
+        return html.decode(encoding or 'utf-8', errors='replace')
+    return html
+
+
+def class_matcher(*class_names: str):
+    """
+    Returns a SoupStrainer attribute filter that matches elements having one of the classes.
+
+    Depending on the bs4 version, the filter gets single class names or the whole
+    attribute value, so the value is split here.
+    """
+    return lambda value: value is not None and not set(class_names).isdisjoint(value.split())
+
+
+# Only these subtrees are built by the BeautifulSoup backend
+MEMBER_LIST_STRAINER = SoupStrainer(class_=class_matcher('contentRow-main', 'pageNav-main'))
+PROFILE_STRAINER = SoupStrainer('dl', class_=class_matcher('pairs--columns'))
+
+
+def to_page_count(page_numbers: List[str]) -> int:
+    """
+    Returns the highest page number of the page navigation, 1 if there is none.
+    """
+    numbers = [int(number) for number in page_numbers if number.isdigit()]
+    return max(numbers) if numbers else 1
+
+
+def get_members_from_dictionary_soup(soup: BeautifulSoup) -> List[Dict[str, str]]:
+    """
+    Extracts members information from a BeautifulSoup object.
+
+    Args:
+        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing member information.
+            Each dictionary contains the following keys:
+            - 'uid': The user ID.
+            - 'name': The member name.
+            - 'location': The member location (if available).
+            - 'href': The member link.
+
+    """
+    members = []
+    for user in soup.select('h3.contentRow-header a.username'):
+        member = {
+            'uid': user['data-user-id'],
+
+            'name': user.get_text(),
+        }
+
+        # Find the parent div with class 'contentRow-main'
+        content_row_main = user.find_parent('div', class_='contentRow-main')
+
+        # Find the div with class 'contentRow-lesser' inside the parent div
+        location_div = content_row_main.find('div', class_='contentRow-lesser')
+
+        # If the location div exists and contains an anchor tag, extract the location
+        if location_div and location_div.find('a'):
+            member['location'] = location_div.find('a').get_text()
+
+        # Store the member link
+        member['href'] = user['href']
+
+        members.append(member)
+    return members
+
+
+def get_page_count_from_soup(soup: BeautifulSoup) -> int:
+    """
+    Extracts the number of member list pages from the page navigation.
+
+    Args:
+        soup (BeautifulSoup): The BeautifulSoup object of a member list page.
+
+    Returns:
+        int: The highest page number, 1 if there is no page navigation.
+    """
+    return to_page_count([a.text for a in soup.select('ul.pageNav-main li.pageNav-page a')])
+
+
+def parse_member_list_bs4(html: str) -> Tuple[List[Dict[str, str]], int]:
+    """
+    BeautifulSoup backend of parse_member_list.
+    """
+    soup = BeautifulSoup(html, 'html.parser', parse_only=MEMBER_LIST_STRAINER)
+    return get_members_from_dictionary_soup(soup), get_page_count_from_soup(soup)
+
+
+def parse_member_list_selectolax(html: str) -> Tuple[List[Dict[str, str]], int]:
+    """
+    selectolax backend of parse_member_list.
+    """
+    tree = HTMLParser(html)
+    members = []
+    for user in tree.css('h3.contentRow-header a.username'):
+        member = {
+            'uid': user.attributes['data-user-id'],
+            'name': user.text(),
+        }
+
+        # Find the parent div with class 'contentRow-main'
+        content_row_main = user.parent
+        while not (content_row_main.tag == 'div' and has_class(content_row_main.attributes.get('class'), 'contentRow-main')):
+            content_row_main = content_row_main.parent
+
+        # If the location div exists and contains an anchor tag, extract the location
+        location_div = content_row_main.css_first('div.contentRow-lesser')
+        location_link = location_div.css_first('a') if location_div else None
+        if location_link:
+            member['location'] = location_link.text()
+
+        member['href'] = user.attributes['href']
+        members.append(member)
+
+    page_count = to_page_count([a.text() for a in tree.css('ul.pageNav-main li.pageNav-page a')])
+    return members, page_count
+
+
+def parse_member_list_lxml(html: str) -> Tuple[List[Dict[str, str]], int]:
+    """
+    lxml backend of parse_member_list.
+    """
+    tree = lxml_html.fromstring(html)
+    members = []
+    for user in tree.xpath(f'//h3[{xpath_class("contentRow-header")}]//a[{xpath_class("username")}]'):
+        member = {
+            'uid': user.attrib['data-user-id'],
+            'name': user.text_content(),
+        }
+
+        # Find the parent div with class 'contentRow-main'
+        content_row_main = next(div for div in user.iterancestors('div') if has_class(div.get('class'), 'contentRow-main'))
+
+        # If the location div exists and contains an anchor tag, extract the location
+        location_divs = content_row_main.xpath(f'.//div[{xpath_class("contentRow-lesser")}]')
+        location_links = location_divs[0].xpath('.//a') if location_divs else []
+        if location_links:
+            member['location'] = location_links[0].text_content()
+
+        member['href'] = user.attrib['href']
+        members.append(member)
+
+    page_count = to_page_count([
+        a.text_content()
+        for a in tree.xpath(f'//ul[{xpath_class("pageNav-main")}]//li[{xpath_class("pageNav-page")}]//a')
+    ])
+    return members, page_count
+
+
+def profile_pairs_bs4(html: str) -> List[Tuple[str, str, str]]:
+    """
+    Returns the HTML and the (dt, dd) texts of the 'dl.pairs--columns' elements, using BeautifulSoup.
+    """
+    soup = BeautifulSoup(html, 'html.parser', parse_only=PROFILE_STRAINER)
+    return [(str(dl), dl.find('dt').text, dl.find('dd').text) for dl in soup.find_all('dl', class_='pairs--columns')]
+
+
+def profile_pairs_selectolax(html: str) -> List[Tuple[str, str, str]]:
+    """
+    Returns the HTML and the (dt, dd) texts of the 'dl.pairs--columns' elements, using selectolax.
+    """
+    return [
+        (dl.html, dl.css_first('dt').text(), dl.css_first('dd').text())
+        for dl in HTMLParser(html).css('dl.pairs--columns')
+    ]
+
+
+def profile_pairs_lxml(html: str) -> List[Tuple[str, str, str]]:
+    """
+    Returns the HTML and the (dt, dd) texts of the 'dl.pairs--columns' elements, using lxml.
+    """
+    if not html.strip():
+        return []
+    return [
+        (lxml_html.tostring(dl, encoding='unicode', with_tail=False),
+         dl.xpath('.//dt')[0].text_content(), dl.xpath('.//dd')[0].text_content())
+        for dl in lxml_html.fromstring(html).xpath(f'//dl[{xpath_class("pairs--columns")}]')
+    ]
+
+
+MEMBER_LIST_PARSERS = {
+    'selectolax': parse_member_list_selectolax,
+    'lxml': parse_member_list_lxml,
+    'bs4': parse_member_list_bs4,
+}
+
+PROFILE_PARSERS = {
+    'selectolax': profile_pairs_selectolax,
+    'lxml': profile_pairs_lxml,
+    'bs4': profile_pairs_bs4,
+}
+
+
+def parse_member_list(html: Union[bytes, str], backend: str = None, encoding: str = None) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Extracts the members and the number of pages from a member list page.
+
+    Args:
+        html (Union[bytes, str]): The HTML content of the member list page, raw or decoded.
+        backend (str): The parser backend, see get_backend.
+        encoding (str): The encoding of raw content, UTF-8 if None.
+
+    Returns:
+        Tuple[List[Dict[str, str]], int]: The members (with 'uid', 'name', 'location'
+            if available, and 'href') and the total number of pages.
+    """
+    return MEMBER_LIST_PARSERS[get_backend(backend)](decode_html(html, encoding))
+
+
+def to_user_details(pairs: List[Tuple[str, str, str]]) -> Dict[str, str]:
+    """
+    Returns the vehicles and remarks of the profile fields found by a backend.
+    """
+    details = {}
+    for _, dt, dd in pairs:
+        key = PROFILE_FIELDS.get(dt.strip())
+        if key:
+            details[key] = dd.strip()
+    return details
+
+
+def parse_user_details(html: str, backend: str = None) -> Dict[str, str]:
+    """
+    Extracts the vehicles and remarks from (a fragment of) a profile page.
+
+    Args:
+        html (str): The HTML content of the profile page or of its 'dl.pairs--columns' elements.
+        backend (str): The parser backend, see get_backend.
+
+    Returns:
+        Dict[str, str]: The found values under the keys 'vm', 'lr', 'tr' and 'other'.
+    """
+    return to_user_details(PROFILE_PARSERS[get_backend(backend)](html))
+
+
+def parse_profile_page(html: Union[bytes, str], backend: str = None, encoding: str = None,
+                       known_fragment_hash: str = None) -> Tuple[str, Dict[str, str]]:
+    """
+    Extracts the user details from a profile page, unless they are known already.
+
+    The relevant part of the page are the 'dl.pairs--columns' elements, as found by the
+    parser backend and serialized by it, so the hash covers exactly what the details are
+    extracted from.
+
+    Args:
+        html (Union[bytes, str]): The HTML content of the profile page, raw or decoded.
+        backend (str): The parser backend, see get_backend.
+        encoding (str): The encoding of raw content, UTF-8 if None.
+        known_fragment_hash (str): The fragment hash of the last parsed version of the page.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: The hash of the relevant part of the page, and the
+            user details, or None if the hash equals `known_fragment_hash`.
+    """
+    pairs = PROFILE_PARSERS[get_backend(backend)](decode_html(html, encoding))
+    fragment = ''.join(element for element, _, _ in pairs)
+    fragment_hash = hashlib.sha256(fragment.encode('utf-8')).hexdigest()
+
+    # The stored details are still valid if the relevant part is unchanged
+    if fragment_hash == known_fragment_hash:
+        return fragment_hash, None
+    return fragment_hash, to_user_details(pairs)
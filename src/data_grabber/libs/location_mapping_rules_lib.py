@@ -1,33 +1,71 @@
+import functools
+import hashlib
 import json
+import os
 import re
 
-with open('libs/country_mapping.json', 'r', encoding='utf-8') as f:
-    country_mapping = json.load(f)
-    # Lowercase the country codes and their location names
-    country_mapping = {k.lower(): [loc.lower() for loc in v] for k, v in country_mapping.items()}
-    f.close()
+# Version of the analysis code; increase it when the analysis changes in a way
+# that is not visible in the mapping files, to invalidate cached analysis results
+ANALYSIS_VERSION = 2
 
-# Create a new structure with reversed key-value pairs
-country_mapping_reverse = {}
-code: object
-for code, names in country_mapping.items():
-    # Add country code as a key
-    country_mapping_reverse[code.lower()] = code.translate(str.maketrans('', '', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+# Directory of the mapping and rules files
+LIBS_DIR = os.path.dirname(os.path.abspath(__file__))
+COUNTRY_MAPPING_PATH = os.path.join(LIBS_DIR, 'country_mapping.json')
+KUERZEL_MAPPING_PATH = os.path.join(LIBS_DIR, 'kuerzel_mapping.json')
+LOCATION_RULES_PATH = os.path.join(LIBS_DIR, 'location_rules.json')
 
-    # Translate city/country names to lowercase
-    for name in names:
-        country_mapping_reverse[name.lower()] = code.translate(str.maketrans('', '', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
-        country_mapping_reverse[name.lower()] = code
 
-# Sortiere die neuen Schlüssel nach der Länge, längere zuerst
-country_mapping_reverse = dict(
-    sorted(country_mapping_reverse.items(), key=lambda item: len(item[0]), reverse=True)
-)
+def load_country_mapping(path: str) -> dict:
+    """
+    Loads the country codes and their location names, all lowercased.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        country_mapping = json.load(f)
+    return {k.lower(): [loc.lower() for loc in v] for k, v in country_mapping.items()}
+
+
+def reverse_country_mapping(country_mapping: dict) -> dict:
+    """
+    Maps every country code and location name to its country code, longest name first.
+    """
+    # Create a new structure with reversed key-value pairs
+    country_mapping_reverse = {}
+    for code, names in country_mapping.items():
+        # Add country code as a key
+        country_mapping_reverse[code.lower()] = code
+
+        # Translate city/country names to lowercase
+        for name in names:
+            country_mapping_reverse[name.lower()] = code
+
+    # Sortiere die neuen Schlüssel nach der Länge, längere zuerst
+    return dict(sorted(country_mapping_reverse.items(), key=lambda item: len(item[0]), reverse=True))
+
+
+def build_country_matcher(names: list) -> re.Pattern:
+    """
+    Compiles one regular expression that finds all given names as whole words.
+
+    At every word boundary, the alternatives are tried in the given order, so with
+    the names sorted longest-first, each match is the longest name starting there.
+    The lookahead makes the matches zero-width, so overlapping names are found, too.
 
-with open('libs/kuerzel_mapping.json', 'r', encoding='utf-8') as f:
-    kuerzel_mapping = json.load(f)
-    kuerzel_mapping = {k.lower(): v.lower() for k, v in kuerzel_mapping.items()}
-    f.close()
+    Args:
+        names (list): The names to search for, sorted longest-first.
+
+    Returns:
+        re.Pattern: A pattern whose group 1 is the matched name.
+    """
+    return re.compile(r'\b(?=(' + '|'.join(re.escape(name) for name in names) + r')\b)')
+
+
+def load_kuerzel_mapping(path: str) -> dict:
+    """
+    Loads the abbreviations and the names they stand for, all lowercased.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        kuerzel_mapping = json.load(f)
+    return {k.lower(): v.lower() for k, v in kuerzel_mapping.items()}
 
 
 def get_country_code(country_name: str, country_mapping: dict) -> str:
@@ -56,9 +94,198 @@ def get_country_code(country_name: str, country_mapping: dict) -> str:
     return None
 
 
+def literals_overlap(first: str, second: str) -> bool:
+    """
+    Tells whether occurrences of two strings can overlap in some text, i.e. whether one
+    contains the other or a suffix of one is a prefix of the other.
+    """
+    if not first or not second:
+        return False
+    if first in second or second in first:
+        return True
+    return any(first.endswith(second[:i]) or second.endswith(first[:i]) for i in range(1, min(len(first), len(second))))
+
+
+def is_independent(earlier: dict, rule: dict) -> bool:
+    """
+    Tells whether a literal rule gives the same result in one scan with an earlier
+    literal rule as when it is applied after it.
+
+    That is the case if the matches of both rules can never overlap, and the later rule
+    can never match in or next to the replacement of the earlier one. A rule that
+    deletes its match joins the text on both sides, so any later rule longer than
+    one character may match across the join.
+    """
+    if literals_overlap(earlier['replace'], rule['replace']):
+        return False
+    if not earlier['with']:
+        return len(rule['replace']) <= 1
+    return not literals_overlap(earlier['with'], rule['replace'])
+
+
+def compile_replacement_step(rules: list) -> tuple:
+    """
+    Compiles replacement rules that can be applied in one scan into one regular expression.
+
+    Literal rules ("replace") are combined into one alternative and dispatched via a
+    dictionary; every regex rule ("pattern") becomes an alternative of its own.
+
+    Args:
+        rules (list): The rules, each a dict with "replace" or "pattern" and "with".
+
+    Returns:
+        tuple: The compiled pattern, the literal replacements and the pattern replacements.
+    """
+    literals = {rule['replace']: rule['with'] for rule in rules if 'replace' in rule}
+    patterns = [rule for rule in rules if 'pattern' in rule]
+
+    alternatives = []
+    if literals:
+        alternatives.append('(?P<literal>' + '|'.join(re.escape(literal) for literal in literals) + ')')
+    alternatives += [f"(?P<p{i}>{rule['pattern']})" for i, rule in enumerate(patterns)]
+
+    return re.compile('|'.join(alternatives)), literals, [rule['with'] for rule in patterns]
+
+
+def compile_replacement_pass(rules: list) -> list:
+    """
+    Compiles a pass of replacement rules into steps that give the same result as
+    applying the rules one after the other in file order.
+
+    Consecutive literal rules share a step (and thus one scan of the string) as long
+    as every rule is independent of the earlier rules of the step, see is_independent;
+    a rule that depends on an earlier one, e.g. because it matches in its replacement,
+    starts a new step. Every regex rule is a step of its own.
+
+    Args:
+        rules (list): The rules, each a dict with "replace" or "pattern" and "with".
+
+    Returns:
+        list: The compiled steps, see compile_replacement_step.
+    """
+    groups = []
+    for rule in rules:
+        group = groups[-1] if groups else None
+        if ('replace' in rule and group and 'replace' in group[0]
+                and all(is_independent(earlier, rule) for earlier in group)):
+            group.append(rule)
+        else:
+            groups.append([rule])
+    return [compile_replacement_step(group) for group in groups]
+
+
+def load_location_rules(path: str) -> dict:
+    """
+    Loads the normalization rules for prepare_location from a JSON file and compiles them.
+
+    Args:
+        path (str): The path of the rules file.
+
+    Returns:
+        dict: The compiled leading words pattern, replacement steps and ignore pattern.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+
+    return {
+        # Remove leading words like 'bei', 'nähe', 'von', etc., also several in a row
+        'leading_words': re.compile(r'^(?:(?:' + '|'.join(map(re.escape, rules['leading_words'])) + r') +)+'),
+        'steps': [step for rules_pass in rules['passes'] for step in compile_replacement_pass(rules_pass)],
+        'ignore': re.compile(r'^(?:' + '|'.join(rules['ignore_patterns']) + r')$'),
+    }
+
+
+def mapping_files_hash(paths: list) -> str:
+    """
+    Computes a hash over the analysis version and the contents of the mapping files.
+
+    Args:
+        paths (list): The paths of the mapping and rules files.
+
+    Returns:
+        str: The hex digest of the hash.
+    """
+    digest = hashlib.sha256(str(ANALYSIS_VERSION).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def mappings() -> dict:
+    """
+    Loads and prepares the mapping and rules files on first use.
+
+    Returns:
+        dict: The country mapping with its reversed form, names, ranks and matcher,
+            the abbreviations, the compiled location rules, and the hash of the files.
+    """
+    country_mapping = load_country_mapping(COUNTRY_MAPPING_PATH)
+    country_mapping_reverse = reverse_country_mapping(country_mapping)
+
+    # Rank of every name in the longest-first order, and the matcher for all of them
+    country_names = list(country_mapping_reverse)
+    return {
+        'country_mapping': country_mapping,
+        'country_mapping_reverse': country_mapping_reverse,
+        'country_names': country_names,
+        'country_name_rank': {name: rank for rank, name in enumerate(country_names)},
+        'country_matcher': build_country_matcher(country_names),
+        'kuerzel_mapping': load_kuerzel_mapping(KUERZEL_MAPPING_PATH),
+        'location_rules': load_location_rules(LOCATION_RULES_PATH),
+        # Changes whenever a mapping file or the rule set changes, for keying cached analysis results
+        'mapping_hash': mapping_files_hash([COUNTRY_MAPPING_PATH, KUERZEL_MAPPING_PATH, LOCATION_RULES_PATH]),
+    }
+
+
+def mapping_hash() -> str:
+    """
+    Returns the hash of the mapping and rules files, see mapping_files_hash.
+    """
+    return mappings()['mapping_hash']
+
+
+def __getattr__(name: str):
+    """
+    Provides the loaded mappings as module attributes, e.g. country_mapping_reverse,
+    without loading them on import.
+    """
+    if name == 'MAPPING_HASH':
+        return mapping_hash()
+    if name in ('country_mapping', 'country_mapping_reverse', 'country_names', 'country_name_rank',
+                'country_matcher', 'kuerzel_mapping', 'location_rules'):
+        return mappings()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def apply_replacement_step(location: str, replacement_step: tuple) -> str:
+    """
+    Applies all rules of a compiled replacement step in one scan.
+
+    Args:
+        location (str): The location string.
+        replacement_step (tuple): A step as returned by compile_replacement_step.
+
+    Returns:
+        str: The location string with all replacements applied.
+    """
+    pattern, literals, replacements = replacement_step
+
+    def replace(match):
+        if match.lastgroup == 'literal':
+            return literals[match.group(0)]
+        return replacements[int(match.lastgroup[1:])]
+
+    return pattern.sub(replace, location)
+
+
 def prepare_location(location: str) -> str:
     """
     Cleans and standardizes the given location string.
+
+    The replacement rules are read from libs/location_rules.json.
+
     Args:
         location (str): The location string to be cleaned and standardized.
     Returns:
@@ -67,59 +294,18 @@ def prepare_location(location: str) -> str:
         None
     """
 
+    location_rules = mappings()['location_rules']
+    kuerzel_mapping = mappings()['kuerzel_mapping']
+
     # Remove leading and trailing whitespace and convert to lowercase
     location = ' '.join(location.strip().split()).lower()
 
     # Remove leading words like 'bei', 'nähe', 'von', etc.
-    while True:
-        new_location = re.sub(r'^(bei|nähe|nahe|von|in|im|der) +', '', location)
-        if new_location == location:
-            break
-        location = new_location
+    location = location_rules['leading_words'].sub('', location)
 
     # Replace specific substrings with their standardized versions
-    location = location.replace("(centro storico)", "")
-    location = location.replace("black forest", "schwarzwald")
-    location = location.replace("s-h", "schleswig-holstein")
-    location = location.replace("b. münchen", "")
-    location = location.replace("südhessen", "hessen")
-    location = location.replace("nordhessen", "hessen")
-    location = location.replace("ostbayern", "bayern")
-    location = location.replace("in niederösterreich", "österreich")
-    location = location.replace("süd brandenburg", "brandenburg")
-    location = location.replace("unter- mittelfranken", "mittelfranken")
-    location = location.replace("/ hunsrück", "")
-    location = location.replace("/main", " am main")
-    location = location.replace("86399 landkreis augsburg", "86399 bobingen")
-    location = location.replace("leipziger land", "")
-    location = location.replace("n.r.w", "nrw")
-    location = location.replace("st.vith", "Sankt Vith, Belgien")
-    location = location.replace("nürtingen a. n.", "nürtingen")
-    location = location.replace("schwabenländle", "baden würtemberg")
-    location = location.replace("ruhrhalbinsel", "überruhr")
-    location = location.replace("umgebung", "")
-    location = location.replace("südlicher wienerwald", "wienerwald, austria")
-    location = location.replace("markgräfler land", "markgräflerland")
-    location = location.replace("stuttgart-vaihingen", "vaihingen")
-    location = location.replace("40000 germany", "düssedorf")
-    location = location.replace("in obb", "in oberbayern")
-    location = location.replace("79***", "schwarzwald")
-    location = location.replace("75... enzkreis", "enzkreis")
-
-    # Replace 'kreis' with 'landkreis' if followed by a lowercase word
-    location = re.sub(r'\bkreis\b(?=\s+[a-zäöüß\-]+)', 'landkreis', location)
-
-    # Remove 'großraum' and 'umland' if followed by a lowercase word
-    location = re.sub(r'\b((groß)?raum|umland)\b(?=\s+[a-zäöüß\-]+)', '', location)
-
-    # Replace specific substrings with their standardized versions
-    location = location.replace("landkreis plön, sh", "kreis plön")
-    location = location.replace("landkreis waf", "kreis warendorf")
-    location = location.replace("(15 km no von stuttgart)", "")
-    location = location.replace("01099 - doppel-d", "dresden")
-
-    # Remove 'bei' followed by a word
-    location = re.sub(r'\bbei\b [\wäöüß\-]+', '', location)
+    for replacement_step in location_rules['steps']:
+        location = apply_replacement_step(location, replacement_step)
 
     # Check if the location string is in the format of a postal code followed by an
     # optional 'bei' and a country code. If it is, replace the postal code and country
@@ -136,9 +322,9 @@ def prepare_location(location: str) -> str:
     if len(location) >= 1 and len(location) <= 3 and location.isalpha() and location in kuerzel_mapping:
         location = kuerzel_mapping.get(location, location)
 
-    # Check if the location string matches any of the listed patterns and if so, return
+    # Check if the location string matches any of the ignored patterns and if so, return
     # `None`.
-    if re.match(r'^(hier|an der isar|norden|nichts|süden|104x|zentral|tor zur welt|süd-?westen|bird mountains)$', location):
+    if location_rules['ignore'].match(location):
         return None
 
     # Check if the location string is a digit and less than or equal to 3 characters long.
@@ -165,6 +351,8 @@ def analyze_location_for_country(location: str) -> str:
     if location is None:
         return None
 
+    data = mappings()
+
     # Convert location to lowercase
     location = location.lower()
 
@@ -174,17 +362,15 @@ def analyze_location_for_country(location: str) -> str:
     # Find country code with postal code
     match = re.match(r'^([a-z]{1,3})[ -](\d{4,5})', location)
     if match:
-        country_code = get_country_code(match.group(1), country_mapping)
+        country_code = get_country_code(match.group(1), data['country_mapping'])
         if country_code is not None:
             return country_code
 
-    # Check for country name in location
-    for name, code in country_mapping_reverse.items():
-
-        # Create a regular expression pattern that ensures the searched name is surrounded by word boundaries
-        pattern = r'\b' + re.escape(name) + r'\b'
-        if re.search(pattern, location):
-            return code
+    # Check for country name in location; like checking the names one by one,
+    # longest first, the name with the lowest rank wins
+    ranks = [data['country_name_rank'][match.group(1)] for match in data['country_matcher'].finditer(location)]
+    if ranks:
+        return data['country_mapping_reverse'][data['country_names'][min(ranks)]]
 
     return None
 
@@ -0,0 +1,83 @@
+"""
+Search index of the map data, written next to vmforum_members.json.
+
+karte.html uses it to fill the hashtag suggestions and to filter the members by set
+operations instead of matching every member. Members are referred to by their
+position in vmforum_members.json; 'members' holds the number of members, so the map
+can tell whether the index belongs to the member list it loaded.
+
+- hashtags: every hashtag of the 'other' field (lowercased), with the number of its
+  occurrences and the positions of the members using it
+- tokens: per field, the positions of the members by normalized word (lowercase,
+  without diacritics)
+- presence: per field, a bitset of the members that filled it in, base64 encoded;
+  bit i (bit i % 8 of byte i // 8) stands for the member at position i
+"""
+import base64
+import re
+import unicodedata
+from typing import Dict, List
+
+# The searchable fields, in the order of the filter bits of karte.html
+INDEX_FIELDS = ['name', 'vm', 'lr', 'tr', 'other']
+
+# Same pattern as the hashtag_regex of karte.html; \w of JavaScript only matches ASCII, e.g. '#Straße' is '#Stra'
+HASHTAG_PATTERN = re.compile(r'#[a-zA-Z]\w+', re.ASCII)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """
+    Splits a text into lowercase words without diacritics, e.g. 'Großraum Nürnberg' into ['großraum', 'nurnberg'].
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_PATTERN.findall(text)
+
+
+def encode_bitset(positions: List[int], size: int) -> str:
+    """
+    Encodes a set of positions below `size` as a base64 bitset.
+    """
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position // 8] |= 1 << (position % 8)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+def build_member_index(members: List[dict]) -> Dict:
+    """
+    Builds the search index of the map data.
+
+    Args:
+        members (List[dict]): The members as written to vmforum_members.json.
+
+    Returns:
+        dict: The index, see the module description.
+    """
+    hashtags = {}
+    tokens = {field: {} for field in INDEX_FIELDS}
+    presence = {field: [] for field in INDEX_FIELDS}
+
+    for position, member in enumerate(members):
+        for field in INDEX_FIELDS:
+            text = member.get(field)
+            if not text:
+                continue
+            presence[field].append(position)
+            for token in dict.fromkeys(normalize_tokens(text)):
+                tokens[field].setdefault(token, []).append(position)
+
+        for hashtag in HASHTAG_PATTERN.findall(member.get('other') or ''):
+            entry = hashtags.setdefault(hashtag.lower(), {'count': 0, 'members': []})
+            entry['count'] += 1
+            if not entry['members'] or entry['members'][-1] != position:
+                entry['members'].append(position)
+
+    return {
+        'members': len(members),
+        'hashtags': dict(sorted(hashtags.items(), key=lambda item: (-item[1]['count'], item[0]))),
+        'tokens': {field: dict(sorted(field_tokens.items())) for field, field_tokens in tokens.items()},
+        'presence': {field: encode_bitset(positions, len(members)) for field, positions in presence.items()},
+    }
@@ -0,0 +1,263 @@
+"""
+Metrics of a run: stage timings, event counters, HTTP latencies and the cache lookups.
+
+The metrics are collected by the Metrics object of the runtime context and written
+at the end of the run as a JSON run report and as a Prometheus textfile (for the
+textfile collector of the node exporter), next to the map data.
+
+With profiling enabled, every stage entered by the main thread is also profiled with
+cProfile and tracemalloc: <stage>.prof can be read with `python -m pstats`, and
+<stage>.memory.txt lists the lines that allocated the most memory during the stage.
+Stages in worker threads are timed, but not profiled.
+
+Stage times are wall times. The work of a thread pool (the profile downloads, the
+geocoding) is timed once around the pool by the thread running it, not per task, since
+the tasks overlap; the latencies of the single requests are in the HTTP histograms.
+The stages of the streamed pipeline run at the same time and nest in
+'scrape_and_geocode', so their times overlap.
+"""
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+
+from libs.output_writer_lib import dump_json, write_atomic
+
+# Upper bounds of the HTTP latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Prefix of the Prometheus metric names
+METRIC_PREFIX = 'vmkarte'
+
+# Number of lines listed in a memory profile
+MEMORY_PROFILE_LINES = 25
+
+
+class Histogram:
+    """
+    Cumulative histogram in the layout of Prometheus.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[tuple]:
+        """
+        Returns (upper bound, number of values up to it) for every bucket, the last one '+Inf'.
+        """
+        result = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """
+    Thread-safe collection of the metrics of one run.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.latencies = {}
+        self.profile_dir = None
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def enable_profiling(self, directory: str) -> None:
+        """
+        Profiles the following stages of the main thread into `directory`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.profile_dir = directory
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a stage; a stage entered several times adds up.
+
+        Args:
+            name (str): The name of the stage, e.g. 'login' or 'geocode'.
+        """
+        profile = self.profile_dir is not None and threading.current_thread() is threading.main_thread()
+        if profile:
+            self._start_profile(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile:
+                self._stop_profile(name)
+            with self._lock:
+                stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                stage['count'] += 1
+                stage['seconds'] += seconds
+                stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+    def _start_profile(self, name: str) -> None:
+        # Only one profiler can run at a time: the one of the enclosing stage pauses
+        if self._profiles:
+            self._profiles[-1][0].disable()
+        profiler = cProfile.Profile()
+        self._profiles.append((profiler, tracemalloc.take_snapshot()))
+        profiler.enable()
+
+    def _stop_profile(self, name: str) -> None:
+        profiler, snapshot = self._profiles.pop()
+        profiler.disable()
+        profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+
+        statistics = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+        with open(os.path.join(self.profile_dir, f'{name}.memory.txt'), 'w', encoding='utf-8') as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f"Traced memory after the stage: {current} bytes, peak so far {peak} bytes\n")
+            for statistic in statistics[:MEMORY_PROFILE_LINES]:
+                f.write(f"{statistic}\n")
+
+        if self._profiles:
+            self._profiles[-1][0].enable()
+
+    def count(self, name: str, amount: float = 1, **labels) -> None:
+        """
+        Increments an event counter, e.g. count('retries', host='www.velomobilforum.de').
+        """
+        with self._lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """
+        Sets a value describing the run, e.g. the number of members written.
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe_request(self, host: str, status, seconds: float) -> None:
+        """
+        Records an HTTP request.
+
+        Args:
+            host (str): The host of the request.
+            status: The status code of the response, or 'error' if there was none.
+            seconds (float): The time until the response arrived.
+        """
+        with self._lock:
+            self.counters['http_requests', (('host', host), ('status', str(status)))] += 1
+            self.latencies.setdefault(host, Histogram()).observe(seconds)
+
+    def report(self, cache_lookups: Dict[str, Dict[str, int]] = None) -> dict:
+        """
+        Returns the metrics of the run so far.
+
+        Args:
+            cache_lookups (Dict[str, Dict[str, int]]): The hits and misses by namespace, see IndexedCache.lookup_stats.
+
+        Returns:
+            dict: The run report.
+        """
+        with self._lock:
+            return {
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'gauges': dict(self.gauges),
+                'http_latency': {
+                    host: {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'buckets': [[bound, count] for bound, count in histogram.cumulative()],
+                    }
+                    for host, histogram in self.latencies.items()
+                },
+                'cache': cache_lookups or {},
+            }
+
+
+def label_text(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def prometheus_text(report: dict) -> str:
+    """
+    Formats a run report in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+        for suffix, labels, value in samples:
+            lines.append(f'{METRIC_PREFIX}_{name}{suffix}{label_text(labels)} {value}')
+
+    metric('last_run_timestamp_seconds', 'gauge', 'Start of the last run.', [('', {}, report['started'])])
+    metric('run_duration_seconds', 'gauge', 'Duration of the last run.', [('', {}, report['seconds'])])
+    metric('stage_seconds', 'gauge', 'Time spent in a stage, summed over its passes.',
+           [('', {'stage': name}, stage['seconds']) for name, stage in sorted(report['stages'].items())])
+    metric('stage_passes', 'gauge', 'Number of passes through a stage.',
+           [('', {'stage': name}, stage['count']) for name, stage in sorted(report['stages'].items())])
+    metric('cache_lookups', 'gauge', 'Cache lookups by namespace and result.',
+           [('', {'namespace': namespace, 'result': result}, count)
+            for namespace, stats in sorted(report['cache'].items(), key=lambda item: str(item[0]))
+            for result, count in sorted(stats.items())])
+
+    # Counters with the same name form one metric
+    counters = {}
+    for counter in report['counters']:
+        counters.setdefault(counter['name'], []).append(('', counter['labels'], counter['value']))
+    for name, samples in sorted(counters.items()):
+        metric(name, 'gauge', f'Number of {name.replace("_", " ")} in the last run.', samples)
+
+    for name, value in sorted(report['gauges'].items()):
+        metric(name, 'gauge', f'{name.replace("_", " ").capitalize()} of the last run.', [('', {}, value)])
+
+    samples = []
+    for host, histogram in sorted(report['http_latency'].items()):
+        samples += [('_bucket', {'host': host, 'le': bound}, count) for bound, count in histogram['buckets']]
+        samples += [('_sum', {'host': host}, histogram['sum']), ('_count', {'host': host}, histogram['count'])]
+    metric('http_request_duration_seconds', 'histogram', 'Duration of the HTTP requests of the last run.', samples)
+    return '\n'.join(lines) + '\n'
+
+
+def write_run_report(report: dict, json_path: str = None, textfile_path: str = None) -> None:
+    """
+    Writes a run report as JSON and as a Prometheus textfile, each only if its path is set.
+
+    Args:
+        report (dict): The run report, see Metrics.report.
+        json_path (str): The path of the JSON report.
+        textfile_path (str): The path of the Prometheus textfile, ending with .prom.
+    """
+    if json_path:
+        write_atomic(json_path, dump_json(report, pretty=True))
+    if textfile_path:
+        write_atomic(textfile_path, prometheus_text(report).encode('utf-8'))
@@ -0,0 +1,134 @@
+"""
+Writing of the output files served by the web server.
+
+Every file is written to a temporary file in the same directory and then renamed,
+so the web server never delivers a half-written file. The JSON output is minified
+and stored pre-compressed next to the original (.gz for nginx gzip_static, .br for
+brotli_static if the brotli package is installed).
+"""
+import gzip
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dump_json(data, pretty: bool = False) -> bytes:
+    """
+    Serializes data to UTF-8 encoded JSON, with orjson if it is installed.
+
+    Args:
+        data: The data to serialize.
+        pretty (bool): Indent the output for reading instead of minifying it.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    """
+    Replaces a file with new content in one step.
+
+    Args:
+        path (str): The path of the file.
+        content (bytes): The new content.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # Temporary files are private; the web server has to read the output
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_compressed(path: str, content: bytes) -> None:
+    """
+    Writes the pre-compressed siblings of a file: path.gz, and path.br if brotli is installed.
+    A .br file that cannot be renewed is removed, so it never gets stale.
+
+    Args:
+        path (str): The path of the uncompressed file.
+        content (bytes): The uncompressed content.
+    """
+    write_atomic(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(path + '.br', brotli.compress(content, quality=11))
+    elif os.path.exists(path + '.br'):
+        os.remove(path + '.br')
+
+
+def remove_compressed(path: str) -> None:
+    """
+    Removes the pre-compressed siblings of a file, if there are any.
+
+    Args:
+        path (str): The path of the uncompressed file.
+    """
+    for suffix in ('.gz', '.br'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def write_json_output(path: str, data, pretty: bool = False, compress: bool = True, min_compress_size: int = 0) -> int:
+    """
+    Writes a JSON output file atomically, with its pre-compressed siblings.
+
+    Args:
+        path (str): The path of the JSON file.
+        data: The data to write.
+        pretty (bool): Indent the output instead of minifying it.
+        compress (bool): Also write the .gz (and .br) files; otherwise those of an earlier run are removed.
+        min_compress_size (int): Only write the compressed files if the JSON has at least this many bytes.
+
+    Returns:
+        int: The size of the uncompressed JSON in bytes.
+    """
+    content = dump_json(data, pretty)
+    if compress and len(content) >= min_compress_size:
+        write_compressed(path, content)
+    else:
+        # The web server would keep delivering the compressed copies of an earlier run
+        remove_compressed(path)
+    write_atomic(path, content)
+    return len(content)
+
+
+def read_json_output(path: str, default=None):
+    """
+    Reads a JSON output file written by write_json_output.
+
+    Args:
+        path (str): The path of the JSON file.
+        default: The value if the file does not exist.
+
+    Returns:
+        The data of the file, or `default`.
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, 'rb') as f:
+        content = f.read()
+    return orjson.loads(content) if orjson is not None else json.loads(content)
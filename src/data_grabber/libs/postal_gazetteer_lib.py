@@ -0,0 +1,222 @@
+"""
+Offline gazetteer of postal codes, imported from the GeoNames postal code dumps
+(https://download.geonames.org/export/zip/, see utils/import_postal_codes.py).
+
+Locations with a postal code are resolved against it before Nominatim is asked. The
+gazetteer is a SQLite table keyed by (country, postcode) with the centroid of the
+places sharing the postal code and a radius that covers them.
+"""
+import csv
+import io
+import math
+import os
+import re
+import sqlite3
+import threading
+import zipfile
+from typing import Dict, Iterable, List, Tuple
+
+from libs.location_mapping_rules_lib import mappings
+
+# Countries tried for a postal code without a known country, by the number of digits,
+# in the order of the Nominatim try lists
+POSTAL_CODE_COUNTRIES = {
+    5: ['de', 'fr', 'fi', 'it'],
+    4: ['at', 'ch', 'dk', 'nl'],
+}
+
+# Smallest radius of a postal code area, and the margin added around its places, in meters
+MIN_POSTAL_RADIUS = 2000
+POSTAL_RADIUS_MARGIN = 1000
+
+EARTH_RADIUS = 6371008.8
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Returns the great-circle distance between two points in meters (haversine formula).
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def read_geonames(path: str) -> Iterable[List[str]]:
+    """
+    Yields the rows of a GeoNames postal code dump, plain text or zipped.
+
+    Args:
+        path (str): The path of e.g. DE.txt, DE.zip or allCountries.zip.
+
+    Yields:
+        List[str]: The tab-separated columns of a row.
+    """
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith('.txt') and not name.lower().startswith('readme'):
+                    with archive.open(name) as f:
+                        yield from csv.reader(io.TextIOWrapper(f, encoding='utf-8'), delimiter='\t', quoting=csv.QUOTE_NONE)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+
+def aggregate_postal_codes(rows: Iterable[List[str]], countries: set = None) -> Dict[Tuple[str, str], tuple]:
+    """
+    Combines the places of every (country, postcode) into one entry.
+
+    Args:
+        rows (Iterable[List[str]]): GeoNames rows: country code, postal code, place name,
+            admin names and codes, latitude, longitude, accuracy.
+        countries (set): Only import these lowercase country codes, all if None.
+
+    Returns:
+        Dict[Tuple[str, str], tuple]: The latitude and longitude of the centroid, the
+            radius in meters and the lowercase place names, by (country, postcode).
+    """
+    places = {}
+    for row in rows:
+        if len(row) < 11 or not row[9] or not row[10]:
+            continue
+        country = row[0].lower()
+        if countries and country not in countries:
+            continue
+        places.setdefault((country, row[1].strip().upper()), []).append((float(row[9]), float(row[10]), row[2].lower()))
+
+    postal_codes = {}
+    for key, points in places.items():
+        lat = sum(point[0] for point in points) / len(points)
+        lon = sum(point[1] for point in points) / len(points)
+        farthest = max(distance(lat, lon, point[0], point[1]) for point in points)
+        radius = max(MIN_POSTAL_RADIUS, round(farthest + POSTAL_RADIUS_MARGIN))
+        postal_codes[key] = (lat, lon, radius, '|'.join(sorted({point[2] for point in points})))
+    return postal_codes
+
+
+def import_geonames(paths: List[str], db_path: str, countries: set = None) -> int:
+    """
+    Builds the gazetteer database from GeoNames postal code dumps.
+
+    The database is written next to `db_path` and then moved into place, so a running
+    data grabber never sees a half-written gazetteer.
+
+    Args:
+        paths (List[str]): The GeoNames files.
+        db_path (str): The path of the gazetteer database.
+        countries (set): Only import these lowercase country codes, all if None.
+
+    Returns:
+        int: The number of imported postal codes.
+    """
+    postal_codes = aggregate_postal_codes((row for path in paths for row in read_geonames(path)), countries)
+
+    temp_path = db_path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    connection = sqlite3.connect(temp_path)
+    connection.execute(
+        'CREATE TABLE postal_codes (country TEXT, postcode TEXT, lat REAL, lon REAL, radius INTEGER, places TEXT,'
+        ' PRIMARY KEY (country, postcode)) WITHOUT ROWID'
+    )
+    connection.executemany(
+        'INSERT INTO postal_codes VALUES (?, ?, ?, ?, ?, ?)',
+        ((country, postcode, *entry) for (country, postcode), entry in sorted(postal_codes.items()))
+    )
+    connection.commit()
+    connection.close()
+    os.replace(temp_path, db_path)
+    return len(postal_codes)
+
+
+class PostalGazetteer:
+    """
+    Read-only access to the gazetteer database; without the database, nothing is found.
+
+    Args:
+        db_path (str): The path of the gazetteer database.
+    """
+
+    def __init__(self, db_path: str):
+        self._connection = None
+        self._lock = threading.Lock()
+        if db_path and os.path.exists(db_path):
+            self._connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+
+    @property
+    def available(self) -> bool:
+        return self._connection is not None
+
+    def lookup(self, postcode: str, countries: List[str]) -> List[tuple]:
+        """
+        Returns the entries of a postal code in the given countries, in the given order.
+
+        Args:
+            postcode (str): The postal code.
+            countries (List[str]): The lowercase country codes.
+
+        Returns:
+            List[tuple]: (country, lat, lon, radius, place names) of every country that has the postal code.
+        """
+        if not self.available or not countries:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT country, lat, lon, radius, places FROM postal_codes'
+                f' WHERE postcode = ? AND country IN ({",".join("?" * len(countries))})',
+                [postcode, *countries]
+            ).fetchall()
+        return sorted(rows, key=lambda row: countries.index(row[0]))
+
+
+def candidate_countries(postal_code: str, country_code: str) -> List[str]:
+    """
+    Returns the countries in which a postal code is looked up.
+
+    Args:
+        postal_code (str): The postal code found in the location.
+        country_code (str): The country code found in the location, can be None.
+
+    Returns:
+        List[str]: The lowercase country codes, most likely first.
+    """
+    if country_code is not None:
+        return [country_code.lower()]
+    return POSTAL_CODE_COUNTRIES.get(len(postal_code), [])
+
+
+def resolve_postal_code(gazetteer: PostalGazetteer, location: str, postal_code: str, country_code: str) -> dict:
+    """
+    Resolves a location with a postal code against the gazetteer.
+
+    If the location names a place or a country besides the postal code, only an entry
+    with that place or in that country is accepted, so that e.g. Austrian and Swiss
+    postal codes are not mixed up; a bare postal code takes the first country that has it.
+
+    Args:
+        gazetteer (PostalGazetteer): The gazetteer.
+        location (str): The prepared location.
+        postal_code (str): The postal code found in the location.
+        country_code (str): The country code found in the location, can be None.
+
+    Returns:
+        dict or None: 'lat' and 'lon' (as strings, like Nominatim's) and 'radius' in meters, if found.
+    """
+    if not postal_code or not location:
+        return None
+
+    entries = gazetteer.lookup(postal_code, candidate_countries(postal_code, country_code))
+    if not entries:
+        return None
+
+    # The words of the location besides the postal code and a country prefix like 'a-',
+    # and the countries they name
+    words = set(re.findall(r'[^\W\d_]{3,}', location))
+    country_mapping_reverse = mappings()['country_mapping_reverse']
+    named_countries = {country_mapping_reverse[word] for word in words if word in country_mapping_reverse}
+
+    for country, lat, lon, radius, places in entries:
+        if not words or country in named_countries or not words.isdisjoint(re.findall(r'[^\W\d_]{3,}', places)):
+            return {'lat': str(round(lat, 7)), 'lon': str(round(lon, 7)), 'radius': radius}
+    return None
@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits requests to `rate` per second.
+
+    Tokens accumulate while no requests are sent, up to `capacity`, so time spent
+    elsewhere (parsing, cache lookups) counts towards the next request. Callers that
+    find the bucket empty reserve a future slot and wait for it; slots are handed out
+    in the order they are requested.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes one token from the bucket.
+
+        Returns:
+            float: The number of seconds the caller has to wait before sending its request.
+        """
+        with self._lock:
+            # Refill the bucket for the time passed since the last call
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # A negative balance is a reservation of a future slot
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request may be sent.
+
+        Returns:
+            float: The number of seconds waited.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def try_acquire(self) -> bool:
+        """
+        Takes one token if the bucket has one, without waiting.
+
+        Returns:
+            bool: Whether a token was taken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
@@ -0,0 +1,286 @@
+"""
+Local stand-ins for the forum and Nominatim, so that the data grabber can be run and
+benchmarked without logging in to velomobilforum.de or querying nominatim.openstreetmap.org.
+
+The forum replays the saved XenForo pages in fixtures/xenforo: the saved member list
+page is served as every page of a member list of configurable length, with the user
+IDs shifted per page so that every page lists other members, and the saved profile
+page is served for every member, with an ETag for conditional requests.
+
+Nominatim replays the answers in fixtures/nominatim/responses.json, which covers the
+searches of the benchmark (utils/benchmark_grabber.py) on the saved member list page.
+Queries without an answer there get a made-up answer that only depends on the query,
+or, in record mode (utils/replay_server.py --record), are forwarded to the real
+Nominatim and their answers added to responses.json.
+
+Every server can delay its answers and limit the request rate (answering 429), and
+counts the requests it received (also served as JSON at /__stats).
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from libs.context_lib import HostClient
+from libs.rate_limiter_lib import TokenBucket
+
+FIXTURES_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fixtures'))
+
+# The user IDs on member list page n are shifted by (n - 1) * USER_ID_STRIDE
+USER_ID_STRIDE = 100000
+
+# One in this many made-up Nominatim queries finds nothing
+NOT_FOUND_RATE = 8
+
+# Status, headers, body and the name under which the request is counted
+Response = Tuple[int, Dict[str, str], bytes, str]
+
+
+def html_response(html: str, name: str, headers: Dict[str, str] = None) -> Response:
+    return 200, {'Content-Type': 'text/html; charset=utf-8', **(headers or {})}, html.encode('utf-8'), name
+
+
+def json_response(data, name: str) -> Response:
+    return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(data).encode('utf-8'), name
+
+
+NOT_FOUND = (404, {'Content-Type': 'text/plain'}, b'Not found', 'not_found')
+
+
+class ReplayForum:
+    """
+    The forum pages of the data grabber: login, member list and profiles.
+
+    Args:
+        fixtures_dir (str): The directory with xenforo/members_list.html and xenforo/profile_about.html.
+        pages (int): The number of member list pages.
+    """
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, pages: int = 10):
+        self.pages = pages
+        with open(os.path.join(fixtures_dir, 'xenforo', 'members_list.html'), 'r', encoding='utf-8') as f:
+            self.list_template = f.read()
+        with open(os.path.join(fixtures_dir, 'xenforo', 'profile_about.html'), 'r', encoding='utf-8') as f:
+            self.profile = f.read()
+        self.profile_hash = hashlib.sha1(self.profile.encode('utf-8')).hexdigest()[:16]
+
+    def list_page(self, number: int) -> str:
+        """
+        Returns member list page `number`: the saved page with shifted user IDs and the
+        page navigation of the configured number of pages.
+        """
+        offset = (number - 1) * USER_ID_STRIDE
+        html = re.sub(r'data-user-id="(\d+)"', lambda m: f'data-user-id="{int(m.group(1)) + offset}"', self.list_template)
+        html = re.sub(r'(\?members/[^"/]*\.)(\d+)/', lambda m: f'{m.group(1)}{int(m.group(2)) + offset}/', html)
+
+        # Links to the first, the current and the last page, like XenForo
+        navigation = ''.join(
+            f'<li class="pageNav-page"><a href="/forum/index.php?members/list/&amp;page={page}">{page}</a></li>'
+            for page in sorted({1, number, self.pages})
+        )
+        return re.sub(r'<ul class="pageNav-main">.*?</ul>', f'<ul class="pageNav-main">{navigation}</ul>', html,
+                      flags=re.DOTALL)
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> Response:
+        query = urlsplit(path).query
+        if query.startswith('login/login'):
+            if method == 'POST':
+                return html_response('<html><body>Willkommen zurück</body></html>', 'login')
+            return html_response('<html><body><form><input type="hidden" name="_xfToken" value="replay" /></form></body></html>', 'login')
+
+        if query.startswith('members/list/'):
+            page = int(dict(parse_qsl(query)).get('page', 1))
+            if not 1 <= page <= self.pages:
+                return NOT_FOUND
+            return html_response(self.list_page(page), 'list_page')
+
+        match = re.match(r'members/[^/]*\.(\d+)/about', query)
+        if match:
+            # The ETag changes with the member and the saved page
+            etag = f'"{match.group(1)}-{self.profile_hash}"'
+            if headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, b'', 'profile_not_modified'
+            return html_response(self.profile, 'profile', {'ETag': etag})
+        return NOT_FOUND
+
+
+class ReplayNominatim:
+    """
+    The Nominatim search of the data grabber.
+
+    Args:
+        fixtures_dir (str): The directory with nominatim/responses.json.
+        record_url (str): The base URL of the real Nominatim; queries without a recording
+            are forwarded to it and recorded. Made up if None.
+    """
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, record_url: str = None):
+        self.path = os.path.join(fixtures_dir, 'nominatim', 'responses.json')
+        self.responses = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.responses = json.load(f)
+        self.record_url = record_url.rstrip('/') if record_url else None
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+        # Forwarded requests follow the usage policy of Nominatim
+        self._client = HostClient(rate=1) if record_url else None
+
+    @staticmethod
+    def request_key(query: str) -> str:
+        """
+        Returns the key of a search in the recordings: its parameters without the e-mail address, sorted.
+        """
+        return urlencode(sorted((name, value) for name, value in parse_qsl(query) if name != 'email'))
+
+    @staticmethod
+    def made_up(params: Dict[str, str]) -> list:
+        """
+        Returns an answer that only depends on the search string: a city somewhere in
+        central Europe, or nothing for some queries and for every search excluding a place.
+        """
+        checksum = zlib.crc32(params.get('q', '').encode('utf-8'))
+        if 'exclude_place_ids' in params or checksum % NOT_FOUND_RATE == 0:
+            return []
+        lat = 46 + checksum % 10000 / 10000 * 8
+        lon = 5 + checksum // 10000 % 10000 / 10000 * 12
+        return [{
+            'place_id': checksum,
+            'lat': f'{lat:.7f}',
+            'lon': f'{lon:.7f}',
+            'type': 'city',
+            'boundingbox': [f'{lat - 0.05:.7f}', f'{lat + 0.05:.7f}', f'{lon - 0.08:.7f}', f'{lon + 0.08:.7f}'],
+            'address': {'country_code': params.get('countrycodes', 'de')},
+        }]
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> Response:
+        parts = urlsplit(path)
+        if parts.path != '/search':
+            return NOT_FOUND
+
+        key = self.request_key(parts.query)
+        with self._lock:
+            data = self.responses.get(key)
+        if data is not None:
+            return json_response(data, 'search_recorded')
+
+        if self.record_url is None:
+            return json_response(self.made_up(dict(parse_qsl(parts.query))), 'search')
+
+        # Record mode: ask the real Nominatim, keep only the successful answers
+        response = self._client.get(f'{self.record_url}{path}')
+        if response.status_code != 200:
+            return response.status_code, {'Content-Type': 'text/plain'}, response.content, 'search_failed'
+        with self._lock:
+            self.responses[key] = response.json()
+            self.recorded += 1
+        return json_response(self.responses[key], 'search_forwarded')
+
+    def save(self) -> None:
+        """
+        Writes the recordings, if any were added.
+        """
+        with self._lock:
+            if not self.recorded:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.responses, f, ensure_ascii=False, indent=1, sort_keys=True)
+            self.recorded = 0
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # Keep the connections open, like the real servers
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def respond(self, method: str) -> None:
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if self.path == '/__stats':
+            status, headers, content, name = json_response(server.request_stats(), None)
+        else:
+            server.count('requests')
+            if server.latency or server.jitter:
+                time.sleep(max(0.0, random.uniform(server.latency - server.jitter, server.latency + server.jitter)))
+            if server.limiter and not server.limiter.try_acquire():
+                status, headers, content, name = 429, {'Retry-After': '1'}, b'Too many requests', 'rate_limited'
+            else:
+                status, headers, content, name = server.app.handle(method, self.path, self.headers, body)
+            server.count(name)
+
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # The requests are counted, not logged
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server on localhost for a ReplayForum or a ReplayNominatim.
+
+    Args:
+        app: The ReplayForum or ReplayNominatim.
+        port (int): The port, any free port if 0.
+        latency (float): The delay of every answer in seconds.
+        jitter (float): The maximum random deviation from `latency` in seconds.
+        rate (float): The maximum number of requests per second; more are answered with 429. Unlimited if None.
+    """
+    daemon_threads = True
+
+    def __init__(self, app, port: int = 0, latency: float = 0.0, jitter: float = 0.0, rate: float = None):
+        super().__init__(('127.0.0.1', port), ReplayHandler)
+        self.app = app
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = TokenBucket(rate, capacity=max(1, rate)) if rate else None
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def request_stats(self) -> Dict[str, int]:
+        """
+        Returns the number of requests received so far, in total and by kind.
+        """
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def start(self) -> 'ReplayServer':
+        """
+        Serves requests in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,114 @@
+"""
+Journal of the progress of a run, so that an interrupted or time-limited run can be
+continued by the next one.
+
+Every member is recorded when its profile has been scraped and again when its
+position has been determined. A run that did not finish is resumed by the next
+start: its recorded members are neither downloaded nor geocoded again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+# Unfinished runs older than this are not resumed, but started over
+RESUME_MAX_AGE = 60*60*24*7
+
+
+class RunJournal:
+    """
+    SQLite journal of the current run, stored in the cache directory.
+
+    Args:
+        directory (str): The directory of the journal database.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'run_journal.db'), check_same_thread=False, isolation_level=None
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            # Every record is a transaction of its own; with WAL, NORMAL syncs only at
+            # checkpoints instead of once per record, and a crash loses at most the last records
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, started REAL, finished REAL, status TEXT)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS members (run_id INTEGER, uid TEXT, stage TEXT, data TEXT,'
+                ' PRIMARY KEY (run_id, uid, stage))'
+            )
+        self.run_id, self.resumed = self._start()
+
+    def _start(self) -> tuple:
+        """
+        Resumes the last run if it did not finish, or starts a new one.
+
+        Returns:
+            tuple: The id of the run, and whether it is resumed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT run_id, started, status FROM runs ORDER BY run_id DESC LIMIT 1'
+            ).fetchone()
+            if row and row[2] != 'complete' and time.time() - row[1] < RESUME_MAX_AGE:
+                self._connection.execute("UPDATE runs SET status = 'running' WHERE run_id = ?", (row[0],))
+                return row[0], True
+
+            # Only the journal of the current run is kept
+            self._connection.execute('DELETE FROM members')
+            self._connection.execute('DELETE FROM runs')
+            run_id = self._connection.execute(
+                "INSERT INTO runs (started, status) VALUES (?, 'running')", (time.time(),)
+            ).lastrowid
+            return run_id, False
+
+    def record(self, uid: str, stage: str, data: dict) -> None:
+        """
+        Records that a member has passed a stage.
+
+        Args:
+            uid (str): The user ID.
+            stage (str): 'scraped' or 'examined'.
+            data (dict): The member's information after the stage.
+        """
+        with self._lock:
+            self._connection.execute(
+                'REPLACE INTO members (run_id, uid, stage, data) VALUES (?, ?, ?, ?)',
+                (self.run_id, uid, stage, json.dumps(data, ensure_ascii=False))
+            )
+
+    def members(self, stage: str) -> Dict[str, dict]:
+        """
+        Returns the members that have passed a stage in this run, in the order they were recorded.
+
+        Args:
+            stage (str): 'scraped' or 'examined'.
+
+        Returns:
+            Dict[str, dict]: The members' information by user ID.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT uid, data FROM members WHERE run_id = ? AND stage = ? ORDER BY rowid', (self.run_id, stage)
+            ).fetchall()
+        return {uid: json.loads(data) for uid, data in rows}
+
+    def finish(self, complete: bool) -> None:
+        """
+        Marks the run as complete, or as partial to be resumed by the next start.
+        """
+        with self._lock:
+            self._connection.execute(
+                'UPDATE runs SET finished = ?, status = ? WHERE run_id = ?',
+                (time.time(), 'complete' if complete else 'partial', self.run_id)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
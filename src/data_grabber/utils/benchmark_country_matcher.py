@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""
+Micro-benchmark for the country detection in analyze_location_for_country.
+
+Compares the former per-name regex loop with the precompiled matcher on a corpus of
+typical forum locations and checks that both return the same country codes.
+
+Run from src/data_grabber:
+    python utils/benchmark_country_matcher.py
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+# Make the libs importable when the script is started from src/data_grabber
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.location_mapping_rules_lib import analyze_location_for_country, country_mapping, country_mapping_reverse, get_country_code
+
+# Locations as they appear in the forum's member list
+CORPUS = [
+    "Berlin", "München", "Hamburg", "Köln", "Frankfurt am Main", "Stuttgart-Vaihingen",
+    "a-1010 wien", "A-5020 Salzburg", "CH-8001 Zürich", "8400 Winterthur, Schweiz",
+    "12345 Stadt", "86399 landkreis augsburg", "D-79098 Freiburg", "79*** schwarzwald",
+    "nähe Bremen", "bei Hannover", "Kreis Plön, SH", "Großraum Nürnberg", "Umland Leipzig",
+    "Südhessen", "Ostbayern", "in Niederösterreich", "Black Forest", "St.Vith",
+    "Eindhoven, Nederland", "Amsterdam", "København", "Aarhus, Danmark", "Bruxelles",
+    "Sankt Vith, Belgien", "Wienerwald, Austria", "Graz", "Innsbruck (Tirol)",
+    "Luxembourg", "Paris, France", "Strasbourg", "Milano, Italia", "Bolzano (centro storico)",
+    "Helsinki", "Stockholm", "Oslo", "London, UK", "Warwickshire. UK", "Dublin, Ireland",
+    "Montreal, Quebec", "Toronto, Canada", "Sydney, Australia", "Buenos Aires, Argentina",
+    "Sofia", "Praha", "Wrocław, Polska", "Ruhrgebiet", "Markgräfler Land", "Enzkreis",
+    "NRW", "Schleswig-Holstein", "Mecklenburg-Vorpommern", "hier", "Norden", "104x",
+]
+
+
+def analyze_location_for_country_loop(location: str) -> str:
+    """
+    The former implementation: one regex search per name, longest name first.
+    """
+    if location is None:
+        return None
+
+    location = location.lower()
+    location = re.sub(r'[^\w\s-]', '', location)
+
+    match = re.match(r'^([a-z]{1,3})[ -](\d{4,5})', location)
+    if match:
+        country_code = get_country_code(match.group(1), country_mapping)
+        if country_code is not None:
+            return country_code
+
+    for name, code in country_mapping_reverse.items():
+        pattern = r'\b' + re.escape(name) + r'\b'
+        if re.search(pattern, location):
+            return code
+
+    return None
+
+
+def per_call_microseconds(function, corpus, number):
+    """
+    Returns the mean time of one call of `function` over the corpus, in microseconds.
+    """
+    seconds = timeit.timeit(lambda: [function(location) for location in corpus], number=number)
+    return seconds / (number * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the country detection on a location corpus.')
+    parser.add_argument('--number', type=int, default=200, help='Number of passes over the corpus')
+    args = parser.parse_args()
+
+    # Both implementations must agree on every location
+    mismatches = [
+        (location, analyze_location_for_country_loop(location), analyze_location_for_country(location))
+        for location in CORPUS
+        if analyze_location_for_country_loop(location) != analyze_location_for_country(location)
+    ]
+    for location, expected, actual in mismatches:
+        print(f"MISMATCH {location!r}: loop={expected!r} matcher={actual!r}")
+
+    before = per_call_microseconds(analyze_location_for_country_loop, CORPUS, args.number)
+    after = per_call_microseconds(analyze_location_for_country, CORPUS, args.number)
+
+    print(f"{'Implementation':<20} {'µs per call':>12}")
+    print("=" * 33)
+    print(f"{'per-name loop':<20} {before:>12.1f}")
+    print(f"{'compiled matcher':<20} {after:>12.1f}")
+    print(f"Speedup: {before / after:.1f}x over {len(CORPUS)} locations, {len(mismatches)} mismatches")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
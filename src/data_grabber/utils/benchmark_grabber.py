@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+"""
+End-to-end benchmark of the data grabber against the local replay servers.
+
+Every repetition runs data_grabber.main twice in a fresh working directory: 'cold'
+with an empty cache and 'warm' with the cache of the cold run. Every run is a fresh
+process, so the peak memory of one run does not hide the one of the next. Reported are
+the wall time, the requests the servers received, the cache hit ratio of the lookups
+and the peak resident set size, as the median of the repetitions.
+
+The forum and Nominatim answers are the fixtures of the replay servers and the settings
+are the defaults (see --set), except for the refresh budgets: they are 0, so the warm
+run answers everything from the cache of the cold run. So the results of two commits are comparable: save them
+with --output and compare a later run with --compare.
+
+Run from src/data_grabber:
+    python utils/benchmark_grabber.py --pages 10 --latency 50 --output before.json
+    python utils/benchmark_grabber.py --pages 10 --latency 50 --compare before.json
+    python utils/benchmark_grabber.py --set nominatim_requests_per_second=20 workers=8
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the libs importable when the script is started from src/data_grabber
+script_dir = os.path.dirname(os.path.abspath(__file__))
+grabber_dir = os.path.join(script_dir, '..')
+sys.path.insert(0, grabber_dir)
+
+from libs.replay_server_lib import FIXTURES_DIR, ReplayForum, ReplayNominatim, ReplayServer
+
+SCENARIOS = ['cold', 'warm']
+
+# Prefix of the result line of a benchmark run
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+# Metrics of the summary: name, heading, format, factor for display
+METRICS = [
+    ('wall_seconds', 'Wall s', '{:>9.2f}', 1),
+    ('forum_requests', 'Forum req', '{:>10.0f}', 1),
+    ('nominatim_requests', 'Nominatim req', '{:>14.0f}', 1),
+    ('cache_hit_ratio', 'Cache hits', '{:>11.1%}', 1),
+    ('max_rss_bytes', 'Max RSS MiB', '{:>12.1f}', 1 / 1024 / 1024),
+]
+
+
+def run_grabber(workdir, grabber_args):
+    """
+    Runs data_grabber.main in `workdir` in this process and prints the result as JSON.
+    """
+    os.chdir(workdir)
+    import data_grabber
+    from libs.context_lib import Context
+
+    ctx = Context()
+    cache = ctx.cache
+    sys.argv = ['data_grabber.py', *grabber_args]
+    start = time.perf_counter()
+    data_grabber.main(ctx)
+    wall = time.perf_counter() - start
+
+    lookups = cache.lookup_stats()
+    hits = sum(stats['hits'] for stats in lookups.values())
+    misses = sum(stats['misses'] for stats in lookups.values())
+    print(RESULT_PREFIX + json.dumps({
+        'wall_seconds': wall,
+        'cache_lookups': lookups,
+        'cache_hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        # Linux reports the maximum resident set size in KiB
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }))
+
+
+def parse_settings(assignments):
+    """
+    Parses key=value settings; values are JSON, or strings if they are no valid JSON.
+    """
+    settings = {}
+    for assignment in assignments or []:
+        key, _, value = assignment.partition('=')
+        try:
+            settings[key] = json.loads(value)
+        except ValueError:
+            settings[key] = value
+    return settings
+
+
+def request_delta(before, after):
+    return after.get('requests', 0) - before.get('requests', 0)
+
+
+def run_repetition(forum, nominatim, settings, grabber_args):
+    """
+    Runs the scenarios in a fresh working directory.
+
+    Returns:
+        list: The result of every scenario.
+    """
+    workdir = tempfile.mkdtemp(prefix='grabber-benchmark-')
+    try:
+        os.makedirs(os.path.join(workdir, 'shared'))
+        with open(os.path.join(workdir, 'config.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'username': 'replay',
+                'password': 'replay',
+                'email': 'benchmark@example.invalid',
+                'forum_url': forum.url,
+                'nominatim_url': nominatim.url,
+                # The warm run only answers from the cache, so it measures cold against warm
+                'refresh_profiles': 0,
+                'refresh_geocodes': 0,
+                **settings,
+            }, f)
+
+        results = []
+        for scenario in SCENARIOS:
+            forum_before, nominatim_before = forum.request_stats(), nominatim.request_stats()
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', workdir, '--', *grabber_args],
+                cwd=grabber_dir, capture_output=True, text=True
+            )
+            lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+            if process.returncode or not lines:
+                print(process.stdout[-2000:], process.stderr[-2000:], sep='\n')
+                raise RuntimeError(f"The {scenario} run failed.")
+
+            result = json.loads(lines[-1][len(RESULT_PREFIX):])
+            result['scenario'] = scenario
+            result['forum_requests'] = request_delta(forum_before, forum.request_stats())
+            result['nominatim_requests'] = request_delta(nominatim_before, nominatim.request_stats())
+            results.append(result)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(runs):
+    """
+    Returns the median of every metric by scenario.
+    """
+    return {
+        scenario: {
+            name: statistics.median(run[name] for run in runs if run['scenario'] == scenario)
+            for name, _, _, _ in METRICS
+        }
+        for scenario in SCENARIOS
+    }
+
+
+def print_summary(summary, baseline=None):
+    """
+    Prints the summary as a table, with the change against a baseline summary.
+    """
+    print(f"{'Scenario':<9}" + ''.join(f" {heading:>{len(fmt.format(0))}}" for _, heading, fmt, _ in METRICS))
+    print("=" * (9 + sum(len(fmt.format(0)) + 1 for _, _, fmt, _ in METRICS)))
+    for scenario, metrics in summary.items():
+        print(f"{scenario:<9}" + ''.join(f" {fmt.format(metrics[name] * factor)}" for name, _, fmt, factor in METRICS))
+        if baseline and scenario in baseline:
+            changes = []
+            for name, _, fmt, _ in METRICS:
+                old = baseline[scenario].get(name)
+                change = f"{(metrics[name] - old) / old:+.1%}" if old else 'n/a'
+                changes.append(f" {change:>{len(fmt.format(0))}}")
+            print(f"{'  change':<9}" + ''.join(changes))
+
+
+def benchmark_parameters(args):
+    """
+    Returns the parameters that determine the results, for the comparison with a baseline.
+    """
+    return {key: value for key, value in vars(args).items() if key not in ('repeat', 'output', 'compare', 'run')}
+
+
+def git_commit():
+    """
+    Returns the current commit of the repository, if git is available.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data grabber end to end against the replay servers.')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='The fixtures directory')
+    parser.add_argument('--pages', type=int, default=10, help='Number of member list pages (20 members each)')
+    parser.add_argument('--latency', type=float, default=50, help='Delay of every answer in milliseconds')
+    parser.add_argument('--jitter', type=float, default=10, help='Maximum random deviation from the delay in milliseconds')
+    parser.add_argument('--forum-rate', type=float, help='Requests per second the forum answers; more get 429')
+    parser.add_argument('--nominatim-rate', type=float, help='Requests per second Nominatim answers; more get 429')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions')
+    parser.add_argument('--set', nargs='+', metavar='KEY=VALUE', help='Settings of config.json for the runs')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the results saved by an earlier --output')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('grabber_args', nargs='*', help='Arguments for data_grabber.py, after --')
+    args = parser.parse_args()
+
+    # Child process: a single run of the grabber
+    if args.run:
+        run_grabber(args.run, args.grabber_args)
+        return 0
+
+    settings = parse_settings(args.set)
+    forum = ReplayServer(ReplayForum(args.fixtures, args.pages), 0,
+                         args.latency / 1000, args.jitter / 1000, args.forum_rate).start()
+    nominatim = ReplayServer(ReplayNominatim(args.fixtures), 0,
+                             args.latency / 1000, args.jitter / 1000, args.nominatim_rate).start()
+    runs = []
+    try:
+        for repetition in range(args.repeat):
+            print(f"Repetition {repetition + 1} / {args.repeat}...")
+            runs += run_repetition(forum, nominatim, settings, args.grabber_args)
+    finally:
+        forum.stop()
+        nominatim.stop()
+
+    summary = summarize(runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline_results = json.load(f)
+        print(f"Compared with commit {baseline_results.get('commit')}")
+        if baseline_results.get('parameters') != benchmark_parameters(args):
+            print("Note: the baseline was measured with other parameters.")
+        baseline = baseline_results['summary']
+    print_summary(summary, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'parameters': benchmark_parameters(args),
+                'summary': summary,
+                'runs': runs,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
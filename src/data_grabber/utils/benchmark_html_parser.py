@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+"""
+Benchmark of the HTML parser backends on saved member list and profile pages.
+
+Every backend runs in a fresh process, so that the peak memory of one backend does not
+hide the one of the next. 'bs4-full' is the former way of parsing: a complete
+BeautifulSoup tree of every page.
+
+Run from src/data_grabber:
+    python utils/benchmark_html_parser.py
+    python utils/benchmark_html_parser.py --list-page saved/list_*.html --profile-page saved/about_*.html
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Make the libs importable when the script is started from src/data_grabber
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, '..'))
+
+from bs4 import BeautifulSoup
+
+from libs.html_parser_lib import available_backends, get_members_from_dictionary_soup, parse_member_list, parse_user_details
+
+FIXTURES_DIR = os.path.join(script_dir, '..', 'fixtures', 'xenforo')
+
+
+def parse_member_list_full_tree(html):
+    """
+    The former member list parsing: a complete tree of the page.
+    """
+    return get_members_from_dictionary_soup(BeautifulSoup(html, 'html.parser'))
+
+
+def parse_user_details_full_tree(html):
+    """
+    The former profile parsing: a complete tree of the page.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    return [(dl.find('dt').text.strip(), dl.find('dd').text.strip()) for dl in soup.find_all('dl', class_='pairs--columns')]
+
+
+def measure(function, pages, seconds):
+    """
+    Parses the pages repeatedly for about `seconds` and returns pages per second and
+    the peak of Python memory allocations during one pass.
+    """
+    # One pass under tracemalloc for the peak memory
+    tracemalloc.start()
+    for html in pages:
+        function(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Repeat passes for the throughput
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for html in pages:
+            function(html)
+        count += len(pages)
+    return count / (time.perf_counter() - start), peak
+
+
+def run_backend(backend, list_pages, profile_pages, seconds):
+    """
+    Benchmarks one backend in this process and prints the result as JSON.
+    """
+    if backend == 'bs4-full':
+        list_function, profile_function = parse_member_list_full_tree, parse_user_details_full_tree
+    else:
+        list_function = lambda html: parse_member_list(html, backend)
+        profile_function = lambda html: parse_user_details(html, backend)
+
+    list_rate, list_peak = measure(list_function, list_pages, seconds)
+    profile_rate, profile_peak = measure(profile_function, profile_pages, seconds)
+    print(json.dumps({
+        'backend': backend,
+        'list_pages_per_second': list_rate,
+        'list_peak_bytes': list_peak,
+        'profile_pages_per_second': profile_rate,
+        'profile_peak_bytes': profile_peak,
+        # Linux reports the maximum resident set size in KiB
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }))
+
+
+def read_pages(patterns):
+    """
+    Reads all files matching the glob patterns.
+    """
+    pages = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r', encoding='utf-8') as f:
+                pages.append(f.read())
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HTML parser backends on saved pages.')
+    parser.add_argument('--list-page', nargs='+', default=[os.path.join(FIXTURES_DIR, 'members_list*.html')],
+                        help='Saved member list pages (glob patterns)')
+    parser.add_argument('--profile-page', nargs='+', default=[os.path.join(FIXTURES_DIR, 'profile_about*.html')],
+                        help='Saved profile "about" pages (glob patterns)')
+    parser.add_argument('--seconds', type=float, default=2, help='Measuring time per backend and page type')
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    list_pages = read_pages(args.list_page)
+    profile_pages = read_pages(args.profile_page)
+    if not list_pages or not profile_pages:
+        print("No sample pages found.")
+        return 1
+
+    # Child process: benchmark a single backend
+    if args.backend:
+        run_backend(args.backend, list_pages, profile_pages, args.seconds)
+        return 0
+
+    # Every backend must extract the same data as the former full-tree parsing
+    expected_members = [parse_member_list_full_tree(html) for html in list_pages]
+    for backend in available_backends():
+        if [parse_member_list(html, backend)[0] for html in list_pages] != expected_members:
+            print(f"MISMATCH: backend '{backend}' extracts different members")
+
+    print(f"{len(list_pages)} member list pages, {len(profile_pages)} profile pages")
+    print(f"{'Backend':<12} {'List pages/s':>13} {'List peak KiB':>14} {'Profiles/s':>11} {'Profile peak KiB':>17} {'Max RSS MiB':>12}")
+    print("=" * 84)
+    for backend in ['bs4-full'] + available_backends():
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--backend', backend, '--seconds', str(args.seconds),
+             '--list-page', *args.list_page, '--profile-page', *args.profile_page],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output)
+        print(
+            f"{backend:<12} {result['list_pages_per_second']:>13.1f} {result['list_peak_bytes'] / 1024:>14.0f} "
+            f"{result['profile_pages_per_second']:>11.1f} {result['profile_peak_bytes'] / 1024:>17.0f} "
+            f"{result['max_rss_bytes'] / 1024 / 1024:>12.1f}"
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
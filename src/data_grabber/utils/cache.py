@@ -1,228 +1,147 @@
-import diskcache as dc
-import random
+#!/usr/bin/python3
+"""
+Administration of the data grabber's cache.
+
+All commands work on the cache index (see libs/cache_index_lib.py), so counts, sizes,
+searches and deletions do not read the cached values; only backfill-radii, a one-time
+migration, reads the cached Nominatim results.
+
+Examples, run from src/data_grabber:
+    python utils/cache.py names
+    python utils/cache.py list nominatim --search kreis
+    python utils/cache.py delete nominatim --search stuttgart nürnberg augsburg
+    python utils/cache.py delete user_details --all
+    python utils/cache.py delete-short nominatim
+    python utils/cache.py refresh nominatim 100
+    python utils/cache.py reindex
+    python utils/cache.py backfill-radii
+"""
+import argparse
 import os
+import sys
+from datetime import datetime
 
+# Make the libs importable when the script is started from src/data_grabber
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, '..'))
 
-def list_cache_contents(cache, cache_names=None):
-    try:
-        # Überprüfen, ob der Cache leer ist
-        if len(cache) == 0:
-            print(f"No entries found in the cache directory {cache_path}.")
-            return
-
-        # Print the header
-        print(f"{'Key':<30} {'Size (Bytes)':<15}")
-        print("="*45)
-
-        # Funktion zur Größenberechnung
-        def get_item_size(item):
-            return len(item) if item else 0
+import diskcache as dc
 
-        # Alle Schlüssel im Cache durchsuchen
-        for key in cache.iterkeys():
-            # Wenn ein Array von Cache-Namen übergeben wurde, nur die relevanten Schlüssel anzeigen
-            if cache_names and (not isinstance(key, tuple) or key[0] not in cache_names):
-                continue
+from libs.cache_index_lib import IndexedCache
+from libs.location_nominatim_lib import backfill_cached_radii
 
-            item = cache.get(key, read=False)
-            size = get_item_size(item)
 
-            if size > 0:
-                if isinstance(key, tuple) and len(key) > 2:
-                    print(f"{str(key):<30} {size:<15}, country={key[2]}")
-                else:
-                    print(f"{str(key):<30} {size:<15}")
+def print_cache_names(cache):
+    """
+    Prints the number of entries and their size for every named cache.
+    """
+    cache.index.purge_expired()
+    named_caches = cache.index.namespaces()
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    if not named_caches:
+        print("No named caches found.")
+        return
 
-def delete_random_data(cache, cache_name, percentage):
-    named_cache_keys = [key for key in cache.iterkeys() if isinstance(key, tuple) and key[0] == cache_name]
+    print(f"{'Named Cache':<30} {'Size (Bytes)':<15} {'Item Count':<15}")
+    print("=" * 60)
+    for name, count, size in named_caches:
+        print(f"{str(name):<30} {size:<15} {count:<15}")
+    print()
 
-    total_items = len(named_cache_keys)
 
-    if total_items == 0:
-        print(f"No items found in named cache '{cache_name}'.")
+def print_entries(entries):
+    """
+    Prints the keys, sizes and expiry dates of index entries.
+    """
+    if not entries:
+        print("No matching entries found.")
         return
 
-    # 1% der Einträge berechnen
-    num_to_delete = int(percentage * total_items / 100)
+    print(f"{'Key':<60} {'Size (Bytes)':<15} {'Expires':<20}")
+    print("=" * 95)
+    for key, size, expires in entries:
+        expiry = datetime.fromtimestamp(expires).strftime('%Y-%m-%d %H:%M') if expires else 'never'
+        print(f"{str(key):<60} {size if size is not None else '?':<15} {expiry:<20}")
+    print(f"{len(entries)} entries")
 
-    # Zufällige Schlüssel auswählen
-    keys_to_delete = random.sample(named_cache_keys, num_to_delete)
 
-    # Schlüssel löschen
-    for key in keys_to_delete:
-        del cache[key]
+def find_entries(cache, namespace, prefix=None, search=None, limit=None):
+    """
+    Returns the index entries of a named cache that match the prefix or one of the search strings.
+    """
+    if not search:
+        return cache.index.find(namespace, prefix=prefix, limit=limit)
 
-    print(f"{num_to_delete} items deleted from named cache '{cache_name}'.")
+    # One indexed query per search string, without duplicates
+    entries = {}
+    for substring in search:
+        for key, size, expires in cache.index.find(namespace, prefix=prefix, substring=substring, limit=limit):
+            entries[key] = (key, size, expires)
+    return list(entries.values())[:limit]
 
 
-def print_cache_names(cache):
-    cache_keys = cache.iterkeys()
-
-    # Dictionary to store the size and count of items in named caches
-    named_caches = {}
-
-    for key in cache_keys:
-        # Keys can be tuples where the first part is the name of the named cache
-        if isinstance(key, tuple) and len(key) > 1:
-            cache_name = key[0]
-            item = cache.get(key, read=False)
-            size = len(item) if item else 0
-            if cache_name in named_caches:
-                named_caches[cache_name]['size'] += size
-                named_caches[cache_name]['count'] += 1
-            else:
-                named_caches[cache_name] = {'size': size, 'count': 1}
+def delete_entries(cache, entries):
+    """
+    Deletes the keys of index entries from the cache.
+    """
+    for key, size, expires in entries:
+        print(f"Deleting key: {key}")
+    print(f"{cache.evict([key for key, size, expires in entries])} items deleted.")
 
-    if not named_caches:
-        print("No named caches found.")
-    else:
-        print(f"{'Named Cache':<30} {'Size (Bytes)':<15} {'Item Count':<15}")
-        print("="*60)
-        for name, info in named_caches.items():
-            print(f"{name:<30} {info['size']:<15} {info['count']:<15}")
-        print()
 
-def delete_named_cache(cache, cache_name):
-    named_cache_keys = [key for key in cache.iterkeys() if isinstance(key, tuple) and key[0] == cache_name]
+def main():
+    parser = argparse.ArgumentParser(description='Administrate the cache of the data grabber.')
+    parser.add_argument('--cache', default=os.path.join(script_dir, '..', 'cache'), help='The cache directory')
+    commands = parser.add_subparsers(dest='command', required=True)
 
-    total_items = len(named_cache_keys)
+    commands.add_parser('names', help='Show the named caches with their item counts and sizes')
 
-    if total_items == 0:
-        print(f"No items found in named cache '{cache_name}'.")
-        return
+    list_parser = commands.add_parser('list', help='List the entries of a named cache')
+    delete_parser = commands.add_parser('delete', help='Delete the matching entries of a named cache')
+    for command_parser in (list_parser, delete_parser):
+        command_parser.add_argument('name', help='The name of the cache, e.g. user_details or nominatim')
+        command_parser.add_argument('--prefix', help='Only keys whose second element starts with this text')
+        command_parser.add_argument('--search', nargs='+', help='Only keys whose second element contains one of these texts')
+    list_parser.add_argument('--limit', type=int, help='The maximum number of entries')
+    delete_parser.add_argument('--all', action='store_true', help='Delete all entries if no filter is given')
 
-    print(f"Found {total_items} items in named cache '{cache_name}'.")
+    short_parser = commands.add_parser('delete-short', help='Delete the entries whose second key element has 1 to 3 letters')
+    short_parser.add_argument('name', help='The name of the cache')
 
-    # Delete all keys
-    for key in named_cache_keys:
-        try:
-            print(f"Deleting key: {key}")
-            del cache[key]
-        except KeyError:
-            print(f"Key not found: {key}")
-        except Exception as e:
-            print(f"Error deleting key {key}: {e}")
+    refresh_parser = commands.add_parser('refresh', help='Delete the oldest entries of a named cache, except negative results')
+    refresh_parser.add_argument('name', help='The name of the cache')
+    refresh_parser.add_argument('count', type=int, help='The number of entries')
 
-    print(f"All items deleted from named cache '{cache_name}'.")
+    commands.add_parser('reindex', help='Rebuild the cache index from the cache')
 
-def delete_from_cache(cache, suchstrings, cachename=None):
-    """
-    Löscht alle Einträge aus dem Cache, deren Schlüssel einen der Suchstrings im zweiten Element enthalten.
+    commands.add_parser('backfill-radii', help='Add the radius to the cached Nominatim results stored without one')
 
-    :param cache: Das Cache-Objekt.
-    :param suchstrings: Ein String oder eine Liste von Strings, die im zweiten Element des Schlüssels enthalten sein müssen, um gelöscht zu werden.
-    :param cachename: Der Name des spezifischen Caches, der bearbeitet werden soll. Wenn None, wird der Hauptcache bearbeitet.
-    """
-    try:
-        # Überprüfen, ob der Cache leer ist
-        if len(cache) == 0:
-            print("Der Cache ist leer.")
-            return
-
-        # Falls suchstrings ein einzelner String ist, diesen in eine Liste umwandeln
-        if isinstance(suchstrings, str):
-            suchstrings = [suchstrings]
-
-        # Schlüssel, die einen der Suchstrings im zweiten Element enthalten, finden und löschen
-        keys_to_delete = []
-        for key in cache.iterkeys():
-            # Wenn ein spezifischer Cache-Name angegeben wurde, nur die relevanten Schlüssel prüfen
-            if cachename and (not isinstance(key, tuple) or key[0] != cachename):
-                continue
-
-            # Überprüfe das zweite Element im Tupel-Schlüssel
-            if isinstance(key, tuple) and len(key) > 1:
-                second_element = key[1]
-                # Überprüfe, ob einer der Suchstrings im zweiten Element enthalten ist
-                if any(suchstring.lower() in str(second_element).lower() for suchstring in suchstrings):
-                    keys_to_delete.append(key)
-                    print(f"Zu löschender Schlüssel gefunden: {key}")
-
-        # Lösche die gefundenen Schlüssel
-        for key in keys_to_delete:
-            try:
-                del cache[key]
-                print(f"Schlüssel gelöscht: {key}")
-            except KeyError:
-                print(f"Schlüssel nicht gefunden oder bereits gelöscht: {key}")
-
-        if not keys_to_delete:
-            print("Keine passenden Schlüssel zum Löschen gefunden.")
-
-    except Exception as e:
-        print(f"Ein Fehler ist aufgetreten: {e}")
-
-def delete_keys_with_short_strings(cache, cachename=None):
-    """
-    Löscht alle Einträge aus dem Cache, deren Schlüssel aus 1 bis 3 Buchstaben besteht
-    und optional zu einem bestimmten Cachename gehören.
+    args = parser.parse_args()
+    cache = IndexedCache(dc.Cache(args.cache))
 
-    :param cache: Das Cache-Objekt.
-    :param cachename: Optionaler Name des spezifischen Caches. Wenn angegeben, werden nur die Schlüssel geprüft, die diesem Cachename entsprechen.
-    """
     try:
-        # Überprüfen, ob der Cache leer ist
-        if len(cache) == 0:
-            print("Der Cache ist leer.")
-            return
-
-        # Schlüssel, die gelöscht werden sollen, finden
-        keys_to_delete = []
-        for key in cache:
-            # Überprüfe das zweite Element im Tupel-Schlüssel, falls vorhanden
-            if isinstance(key, tuple):
-                if len(key) > 1 and isinstance(key[1], str):
-                    second_element = key[1]
-                    # Überprüfen, ob der Cachename übereinstimmt, falls angegeben
-                    if cachename and key[0] != cachename:
-                        continue
-                    # Überprüfen, ob das zweite Element aus 1 bis 3 Buchstaben besteht
-                    if len(second_element) <= 3 and second_element.isalpha():
-                        keys_to_delete.append(key)
-                        print(f"Zu löschender Schlüssel gefunden: {key}")
-            elif isinstance(key, str) and len(key) <= 3 and key.isalpha():
-                if cachename:
-                    # Wenn der Cachename gegeben ist, überspringe nicht-Tupel-Schlüssel
-                    continue
-                keys_to_delete.append(key)
-                print(f"Zu löschender Schlüssel gefunden: {key}")
-
-        # Lösche die gefundenen Schlüssel
-        for key in keys_to_delete:
-            try:
-                del cache[key]
-                print(f"Schlüssel gelöscht: {key}")
-            except KeyError:
-                print(f"Schlüssel nicht gefunden oder bereits gelöscht: {key}")
-
-        if not keys_to_delete:
-            print("Keine passenden Schlüssel zum Löschen gefunden.")
-
-    except Exception as e:
-        print(f"Ein Fehler ist aufgetreten: {e}")
-
-
-# Berechne den Pfad zum Cache relativ zum Skript
-script_dir = os.path.dirname(os.path.abspath(__file__))
-cache_path = os.path.join(script_dir, '../cache')
-
-# Öffne den benannten Cache
-cache = dc.Cache(cache_path)
-
-
-#del cache[('nominatim', 'warwickshire.   uk', 'gb', None)]
-print_cache_names(cache)
-#delete_named_cache(cache, "user_details")
-#delete_random_data(cache, "member_page", 1)
-#delete_random_data(cache, "user_details", 1)
-#delete_random_data(cache, "nominatim", 1)
-#delete_random_data(cache, "members_dict", 100)
-list_cache_contents(cache, 'nominatim')
-#delete_from_cache(cache,['stuttgart','nürnberg','augsburg','hamburg','köln','berlin','mainz','düsseldorf','essen','dortmund','duisburg', 'frankfurt', 'leipzig'],"nominatim")
-#delete_from_cache(cache, 'kreis', 'nominatim')
-#delete_keys_with_short_strings(cache, 'nominatim')
-
-cache.close()
\ No newline at end of file
+        if args.command == 'names':
+            print_cache_names(cache)
+        elif args.command == 'list':
+            print_entries(find_entries(cache, args.name, args.prefix, args.search, args.limit))
+        elif args.command == 'delete':
+            if not (args.prefix or args.search or args.all):
+                print("Give --prefix, --search or --all.")
+                return 1
+            delete_entries(cache, find_entries(cache, args.name, args.prefix, args.search))
+        elif args.command == 'delete-short':
+            entries = cache.index.find(args.name, max_label_length=3)
+            delete_entries(cache, [entry for entry in entries if isinstance(entry[0][1], str) and entry[0][1].isalpha()])
+        elif args.command == 'refresh':
+            print(f"{cache.evict(cache.index.stalest(args.name, args.count))} items deleted.")
+        elif args.command == 'reindex':
+            print(f"{cache.reindex()} entries indexed.")
+        elif args.command == 'backfill-radii':
+            print(f"Added the radius to {backfill_cached_radii(cache)} cached Nominatim results.")
+    finally:
+        cache.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
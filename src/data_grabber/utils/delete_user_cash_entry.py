@@ -2,8 +2,14 @@
 
 import argparse
 import os
+import sys
 import diskcache as dc
 
+# Make the libs importable when the script is started from src/data_grabber
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.cache_index_lib import IndexedCache
+
 
 def main():
     """
@@ -32,18 +38,18 @@ def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     cache_path = os.path.join(script_dir, '../cache')
 
-    # Open the named cache
-    cache = dc.Cache(cache_path)
+    # Open the named cache, keeping its index up to date
+    cache = IndexedCache(dc.Cache(cache_path))
 
     # Key for the uid in the cache
     key = (cache_name, uid)
 
     # Delete the uid from the cache
-    if key in cache:
-        del cache[key]
+    if cache.delete(key):
         print(f'uid "{uid}" was deleted from the cache "{cache_name}".')
     else:
         print(f'uid "{uid}" was not found in the cache "{cache_name}".')
+    cache.close()
 
 
 if __name__ == '__main__':
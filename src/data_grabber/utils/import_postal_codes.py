@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+"""
+Imports GeoNames postal code dumps into the offline postal code gazetteer.
+
+Download e.g. DE.zip, AT.zip, CH.zip or allCountries.zip from
+https://download.geonames.org/export/zip/ and run from src/data_grabber:
+    python utils/import_postal_codes.py DE.zip AT.zip CH.zip
+    python utils/import_postal_codes.py allCountries.zip --countries de at ch dk nl fr fi it
+"""
+import argparse
+import os
+import sys
+
+# Make the libs importable when the script is started from src/data_grabber
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.context_lib import DEFAULT_CONFIG
+from libs.postal_gazetteer_lib import import_geonames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import GeoNames postal code dumps into the postal code gazetteer.')
+    parser.add_argument('files', nargs='+', help='GeoNames postal code files (.txt or .zip)')
+    parser.add_argument('--db', default=DEFAULT_CONFIG['postal_gazetteer'],
+                        help='The gazetteer database, as set by "postal_gazetteer" in config.json')
+    parser.add_argument('--countries', nargs='+', help='Only import these country codes')
+    args = parser.parse_args()
+
+    countries = {country.lower() for country in args.countries} if args.countries else None
+    count = import_geonames(args.files, args.db, countries)
+    print(f"{count} postal codes imported into {args.db}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Runs the local stand-ins for the forum and Nominatim until Ctrl+C.
+
+Point the data grabber at them with "forum_url" and "nominatim_url" in config.json,
+as printed at the start. With --record, Nominatim queries without a recording are
+forwarded to the real Nominatim and their answers are saved to the fixtures.
+
+Run from src/data_grabber:
+    python utils/replay_server.py --pages 20 --latency 80 --jitter 30
+    python utils/replay_server.py --record
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Make the libs importable when the script is started from src/data_grabber
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.context_lib import DEFAULT_CONFIG
+from libs.replay_server_lib import FIXTURES_DIR, ReplayForum, ReplayNominatim, ReplayServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the saved forum pages and Nominatim answers locally.')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='The fixtures directory')
+    parser.add_argument('--pages', type=int, default=10, help='Number of member list pages')
+    parser.add_argument('--forum-port', type=int, default=8081, help='Port of the forum')
+    parser.add_argument('--nominatim-port', type=int, default=8082, help='Port of Nominatim')
+    parser.add_argument('--latency', type=float, default=0, help='Delay of every answer in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='Maximum random deviation from the delay in milliseconds')
+    parser.add_argument('--forum-rate', type=float, help='Requests per second the forum answers; more get 429')
+    parser.add_argument('--nominatim-rate', type=float, help='Requests per second Nominatim answers; more get 429')
+    parser.add_argument('--record', action='store_true',
+                        help='Forward unknown Nominatim queries to the real Nominatim and record the answers')
+    args = parser.parse_args()
+
+    forum = ReplayServer(ReplayForum(args.fixtures, args.pages), args.forum_port,
+                         args.latency / 1000, args.jitter / 1000, args.forum_rate).start()
+    nominatim_app = ReplayNominatim(args.fixtures, DEFAULT_CONFIG['nominatim_url'] if args.record else None)
+    nominatim = ReplayServer(nominatim_app, args.nominatim_port,
+                             args.latency / 1000, args.jitter / 1000, args.nominatim_rate).start()
+
+    print("Settings for config.json:")
+    print(json.dumps({'forum_url': forum.url, 'nominatim_url': nominatim.url}, indent=2))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        forum.stop()
+        nominatim.stop()
+        nominatim_app.save()
+
+    print(f"Forum requests: {forum.request_stats()}")
+    print(f"Nominatim requests: {nominatim.request_stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())